@@ -0,0 +1,49 @@
+"""Habit query indexes
+
+Revision ID: 26d22d32a1b9
+Revises: 5cdb31d708c3
+Create Date: 2026-10-18 14:54:26.385466
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '26d22d32a1b9'
+down_revision: Union[str, None] = '5cdb31d708c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индексы строятся без блокировки записи в таблицу, поэтому вне транзакции миграции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_habit_user_id_alert_date', 'habit', ['user_id', 'alert_date'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            'ix_habit_user_id_active', 'habit', ['user_id'],
+            unique=False, postgresql_where=sa.text('completed_date IS NULL'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            'ix_habit_user_id_completed_date', 'habit', ['user_id', 'completed_date'],
+            unique=False, postgresql_where=sa.text('completed_date IS NOT NULL'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            'ix_habit_alert_date_alert_time', 'habit', ['alert_date', 'alert_time'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_habit_alert_date_alert_time', table_name='habit', postgresql_concurrently=True)
+        op.drop_index('ix_habit_user_id_completed_date', table_name='habit', postgresql_concurrently=True)
+        op.drop_index('ix_habit_user_id_active', table_name='habit', postgresql_concurrently=True)
+        op.drop_index('ix_habit_user_id_alert_date', table_name='habit', postgresql_concurrently=True)
@@ -0,0 +1,26 @@
+"""User habits version
+
+Revision ID: 32232a1a0a34
+Revises: 504edaae9dda
+Create Date: 2026-10-18 15:42:19.306218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '32232a1a0a34'
+down_revision: Union[str, None] = '504edaae9dda'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user', sa.Column('habits_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('user', 'habits_version')
@@ -0,0 +1,36 @@
+"""Habit alerted date
+
+Revision ID: 504edaae9dda
+Revises: 7fd32719d7fd
+Create Date: 2026-10-18 14:58:07.411257
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.settings import TZ
+
+
+# revision identifiers, used by Alembic.
+revision: str = '504edaae9dda'
+down_revision: Union[str, None] = '7fd32719d7fd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('habit', sa.Column('alerted_date', sa.Date(), nullable=True))
+    # Напоминания за прошедшие дни и за сегодня, время которых уже наступило, отправлены планировщиком ранее
+    op.execute(
+        sa.text(
+            "UPDATE habit SET alerted_date = alert_date "
+            "WHERE alert_date < CAST(timezone(:tz, now()) AS date) "
+            "OR (alert_date = CAST(timezone(:tz, now()) AS date) AND alert_time <= CAST(timezone(:tz, now()) AS time))"
+        ).bindparams(tz=TZ)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('habit', 'alerted_date')
@@ -0,0 +1,32 @@
+"""Processed update table
+
+Revision ID: 5cdb31d708c3
+Revises: 0d93437690b8
+Create Date: 2026-10-18 14:53:36.360304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5cdb31d708c3'
+down_revision: Union[str, None] = '0d93437690b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('processed_update',
+    sa.Column('update_id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('update_id')
+    )
+    op.create_index(op.f('ix_processed_update_received_at'), 'processed_update', ['received_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_processed_update_received_at'), table_name='processed_update')
+    op.drop_table('processed_update')
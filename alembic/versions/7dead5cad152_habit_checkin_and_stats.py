@@ -0,0 +1,52 @@
+"""Habit checkin and stats
+
+Revision ID: 7dead5cad152
+Revises: 8620fb3df1a4
+Create Date: 2026-10-18 16:48:12.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7dead5cad152'
+down_revision: Union[str, None] = '8620fb3df1a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('habit_checkin',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('checkin_date', sa.Date(), nullable=False),
+    sa.Column('outcome', sa.String(length=16), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.CheckConstraint("outcome IN ('done', 'missed')", name='check_outcome'),
+    sa.ForeignKeyConstraint(['habit_id'], ['habit.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('habit_id', 'checkin_date', name='uq_habit_checkin_habit_id_checkin_date')
+    )
+    op.create_table('habit_stats',
+    sa.Column('habit_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('current_streak', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('best_streak', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('completions', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('misses', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('last_checkin_date', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['habit_id'], ['habit.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('habit_id')
+    )
+    # История до появления таблиц неизвестна: счётчик process равен текущей серии выполнения
+    op.execute(
+        'INSERT INTO habit_stats (habit_id, current_streak, best_streak, completions, misses) '
+        'SELECT id, process, process, process, 0 FROM habit'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('habit_stats')
+    op.drop_table('habit_checkin')
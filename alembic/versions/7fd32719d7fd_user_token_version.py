@@ -0,0 +1,26 @@
+"""User token version
+
+Revision ID: 7fd32719d7fd
+Revises: 26d22d32a1b9
+Create Date: 2026-10-18 14:56:04.176544
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7fd32719d7fd'
+down_revision: Union[str, None] = '26d22d32a1b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('user', 'token_version')
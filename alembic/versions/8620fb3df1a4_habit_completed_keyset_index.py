@@ -0,0 +1,44 @@
+"""Habit completed keyset index
+
+Revision ID: 8620fb3df1a4
+Revises: 32232a1a0a34
+Create Date: 2026-10-18 16:05:41.527310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8620fb3df1a4'
+down_revision: Union[str, None] = '32232a1a0a34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индекс покрывает сортировку постраничного вывода (completed_date, id),
+    # заменяет индекс по (user_id, completed_date)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_habit_user_id_completed_date_id', 'habit', ['user_id', 'completed_date', 'id'],
+            unique=False, postgresql_where=sa.text('completed_date IS NOT NULL'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            'ix_habit_user_id_completed_date', table_name='habit', postgresql_concurrently=True, if_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_habit_user_id_completed_date', 'habit', ['user_id', 'completed_date'],
+            unique=False, postgresql_where=sa.text('completed_date IS NOT NULL'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            'ix_habit_user_id_completed_date_id', table_name='habit', postgresql_concurrently=True, if_exists=True
+        )
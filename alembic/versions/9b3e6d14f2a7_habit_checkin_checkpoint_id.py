@@ -0,0 +1,37 @@
+"""Habit checkin checkpoint id
+
+Revision ID: 9b3e6d14f2a7
+Revises: e5a1f07c3b82
+Create Date: 2026-10-18 21:14:52.318406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e6d14f2a7'
+down_revision: Union[str, None] = 'e5a1f07c3b82'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('habit_checkin', sa.Column('checkpoint_id', sa.BigInteger(), nullable=True))
+    # Индекс строится без блокировки записи в историю выполнения
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_habit_checkin_checkpoint_id', 'habit_checkin', ['checkpoint_id'],
+            unique=False, postgresql_where=sa.text('checkpoint_id IS NOT NULL'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_habit_checkin_checkpoint_id', table_name='habit_checkin', postgresql_concurrently=True, if_exists=True
+        )
+    op.drop_column('habit_checkin', 'checkpoint_id')
@@ -0,0 +1,52 @@
+"""User timezone and habit alert at
+
+Revision ID: c41e9b27d0f5
+Revises: 7dead5cad152
+Create Date: 2026-10-18 17:20:44.518302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.settings import TZ
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e9b27d0f5'
+down_revision: Union[str, None] = '7dead5cad152'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user', sa.Column('timezone', sa.String(), server_default=TZ, nullable=False))
+    op.add_column('habit', sa.Column('alert_at', sa.DateTime(timezone=True), nullable=True))
+    # Даты и время напоминаний существующих целей заданы в часовом поясе TZ
+    op.execute(
+        sa.text(
+            "UPDATE habit SET alert_at = timezone(:tz, alert_date + alert_time) WHERE alert_date IS NOT NULL"
+        ).bindparams(tz=TZ)
+    )
+    # Индекс по моменту напоминания в UTC заменяет индекс по местным дате и времени напоминания
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_habit_alert_at', 'habit', ['alert_at'],
+            unique=False, postgresql_where=sa.text('completed_date IS NULL'),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            'ix_habit_alert_date_alert_time', table_name='habit', postgresql_concurrently=True, if_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_habit_alert_date_alert_time', 'habit', ['alert_date', 'alert_time'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index('ix_habit_alert_at', table_name='habit', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('habit', 'alert_at')
+    op.drop_column('user', 'timezone')
@@ -0,0 +1,37 @@
+"""Rollover checkpoint
+
+Revision ID: e5a1f07c3b82
+Revises: c41e9b27d0f5
+Create Date: 2026-10-18 18:02:37.904115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a1f07c3b82'
+down_revision: Union[str, None] = 'c41e9b27d0f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('rollover_checkpoint',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('first_user_id', sa.Integer(), nullable=False),
+    sa.Column('last_user_id', sa.Integer(), nullable=False),
+    sa.Column('reset', sa.Integer(), nullable=False),
+    sa.Column('reset_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('notified', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('notified_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_rollover_checkpoint_reset_at'), 'rollover_checkpoint', ['reset_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_rollover_checkpoint_reset_at'), table_name='rollover_checkpoint')
+    op.drop_table('rollover_checkpoint')
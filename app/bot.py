@@ -1,82 +1,182 @@
+from typing import Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
 from telebot import types
 from telebot.async_telebot import AsyncTeleBot
 
-from app.services import get_actual_habits, get_completed_habits, get_markup, mark_habit
+from app.core.metrics import bot_handler_duration, timed
+from app.core.router import CallbackQuery, Message, UpdateRouter
+from app.services import (
+    answer_callback,
+    get_actual_habits,
+    get_completed_habits,
+    get_markup,
+    get_user,
+    get_user_timezone,
+    invalidate_agenda,
+    mark_habit,
+    send_message,
+    send_queue,
+    set_user_timezone,
+)
+from app.services.habit import HabitsPage, format_habit_key, parse_habit_key
+from app.services.user import UserIdentity
 from app.settings import BOT_TOKEN
 
+# Длинные названия привычек обрезаются, чтобы страница архива не превысила ограничение Telegram на длину сообщения
+ARCHIVE_TITLE_LENGTH = 200
+
 bot = AsyncTeleBot(BOT_TOKEN)
+# Таблицы обработчиков команд и нажатий кнопок заполняются декораторами ниже при импорте модуля
+router = UpdateRouter()
 
 
-@bot.message_handler(commands=['start'])
-async def start(message):
+@router.command('start')
+@timed(bot_handler_duration, 'start')
+async def start(message: Message, user: UserIdentity, session: AsyncSession) -> None:
     """
     Инициализация бота
     """
 
-    extra_data = message.json['extra_data']
-    user = extra_data['user']
-
     webapp_cmd = types.BotCommand(command='webapp', description='Редактировать цели')
     archive_cmd = types.BotCommand(command='archive', description='Список завершённых целей')
     mark_cmd = types.BotCommand(command='mark', description='Отметить выполнение')
+    timezone_cmd = types.BotCommand(command='timezone', description='Часовой пояс')
 
-    await bot.set_my_commands([mark_cmd, webapp_cmd, archive_cmd])
+    await bot.set_my_commands([mark_cmd, webapp_cmd, archive_cmd, timezone_cmd])
     await bot.set_chat_menu_button(message.chat.id, types.MenuButtonCommands('commands'))
 
-    await bot.send_message(
+    send_message(
         message.chat.id,
         f'Здравствуйте, {user.name}. Я HabitBot. Давайте менять жизнь к лучшему вместе. 😉',
     )
 
 
-@bot.message_handler(commands=['webapp'])
-async def webapp(message):
+@router.command('webapp')
+@timed(bot_handler_duration, 'webapp')
+async def webapp(message: Message, user: UserIdentity, session: AsyncSession) -> None:
     """
     Получение кнопки для доступа к webapp
     """
 
-    extra_data = message.json['extra_data']
-    user = extra_data['user']
-
-    await bot.send_message(
+    send_message(
         message.chat.id,
         text='Вам нужно добавить новые цели или отредактировать существующие? Тогда кликайте по кнопке "Мои цели".',
-        reply_markup=get_markup(user=user),
+        reply_markup=get_markup(user=await get_user(session=session, user_id=user.id)),
     )
 
 
-@bot.message_handler(commands=['archive'])
-async def archive(message):
+@router.command('timezone')
+@timed(bot_handler_duration, 'timezone')
+async def timezone(message: Message, user: UserIdentity, session: AsyncSession) -> None:
     """
-    Список выработанных привычек
+    Просмотр и изменение часового пояса, по которому отправляются напоминания и подводятся итоги дня
     """
 
-    extra_data = message.json['extra_data']
-    user = extra_data['user']
-    session = extra_data['session']
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        current = await get_user_timezone(session=session, user_id=user.id)
+        send_message(
+            message.chat.id,
+            f'Ваш часовой пояс: {current}. Чтобы изменить его, отправьте команду с названием часового пояса, '
+            'например: /timezone Europe/Berlin',
+        )
+        return
 
-    completed_habits = await get_completed_habits(session=session, user_id=user.id)
-    if completed_habits:
-        msg_items = [
-            f'🏆 {i}. | {habit.completed_date} | {habit.title}' for i, habit in enumerate(completed_habits, start=1)
-        ]
-        msg = '\n'.join(msg_items)
+    name = args[1].strip()
+    db_user = await get_user(session=session, user_id=user.id)
+    if not await set_user_timezone(session=session, user=db_user, timezone=name):
+        send_message(message.chat.id, f'❗ Неизвестный часовой пояс "{name}". Пример: /timezone Asia/Yekaterinburg')
+        return
+
+    # Список целей на сегодня зависит от местной даты пользователя
+    invalidate_agenda(user.id)
+    send_message(message.chat.id, f'✅ Часовой пояс изменён на {name}. Напоминания будут приходить по местному времени')
+
+
+def get_archive_message(page: HabitsPage, start: int) -> tuple[str, Union[types.InlineKeyboardMarkup, None]]:
+    """
+    Текст страницы списка выработанных привычек и кнопки перехода между страницами
+
+    В callback-данных кнопок передаётся номер первой привычки страницы и ключ, от которого выбирается страница
+    """
+
+    msg = '\n'.join(
+        f'🏆 {i}. | {habit.completed_date} | {habit.title[:ARCHIVE_TITLE_LENGTH]}'
+        for i, habit in enumerate(page.habits, start=start)
+    )
+
+    buttons = []
+    if page.has_prev:
+        buttons.append(
+            types.InlineKeyboardButton(
+                text='⬅ Назад', callback_data=f'archive#prev#{start}#{format_habit_key(page.first_key)}'
+            )
+        )
+    if page.has_next:
+        buttons.append(
+            types.InlineKeyboardButton(
+                text='Далее ➡',
+                callback_data=f'archive#next#{start + len(page.habits)}#{format_habit_key(page.last_key)}',
+            )
+        )
+    if not buttons:
+        return msg, None
+
+    markup = types.InlineKeyboardMarkup()
+    markup.row(*buttons)
+    return msg, markup
+
+
+@router.command('archive')
+@timed(bot_handler_duration, 'archive')
+async def archive(message: Message, user: UserIdentity, session: AsyncSession) -> None:
+    """
+    Список выработанных привычек (первая страница)
+    """
+
+    page = await get_completed_habits(session=session, user_id=user.id)
+    if page.habits:
+        msg, markup = get_archive_message(page=page, start=1)
+        send_message(message.chat.id, text=msg, reply_markup=markup)
     else:
-        msg = '❌ Вы пока ещё не закончили работу над какими-либо привычками'
+        send_message(message.chat.id, text='❌ Вы пока ещё не закончили работу над какими-либо привычками')
 
-    await bot.send_message(message.chat.id, text=msg)
 
+@router.callback('archive')
+@timed(bot_handler_duration, 'archive_page_handler')
+async def archive_page_handler(callback: CallbackQuery, user: UserIdentity, session: AsyncSession) -> None:
+    """
+    Переход между страницами списка выработанных привычек
+    """
 
-@bot.message_handler(commands=['mark'])
-async def mark(message):
+    answer_callback(callback.id)
+    _, direction, start, key = callback.data.split('#')
+    start, key = int(start), parse_habit_key(key)
+    if direction == 'next':
+        page = await get_completed_habits(session=session, user_id=user.id, after=key)
+    else:
+        page = await get_completed_habits(session=session, user_id=user.id, before=key)
+        start -= len(page.habits)
+
+    if page.habits:
+        msg, markup = get_archive_message(page=page, start=start)
+        send_queue.put(
+            callback.message.chat.id,
+            'edit_message_text',
+            text=msg,
+            message_id=callback.message.message_id,
+            reply_markup=markup,
+        )
+
+
+@router.command('mark')
+@timed(bot_handler_duration, 'mark')
+async def mark(message: Message, user: UserIdentity, session: AsyncSession) -> None:
     """
     Список активных целей на день
     """
 
-    extra_data = message.json['extra_data']
-    user = extra_data['user']
-    session = extra_data['session']
-
     actual_habits = await get_actual_habits(session=session, user_id=user.id)
 
     if actual_habits:
@@ -87,34 +187,63 @@ async def mark(message):
         ]
         markup.add(*buttons)
 
-        await bot.send_message(
+        send_message(
             message.chat.id,
             text='Чтобы отметить выполнение, просто нажмите соответствующую кнопку',
             reply_markup=markup,
         )
     else:
-        await bot.send_message(message.chat.id, text='У Вас нет целей на сегодня')
+        send_message(message.chat.id, text='У Вас нет целей на сегодня')
 
 
-@bot.callback_query_handler(func=lambda callback: callback.data.startswith('habit#'))
-async def mark_habit_handler(callback):
+def remove_habit_button(
+    markup: types.InlineKeyboardMarkup, callback_data: str
+) -> Union[types.InlineKeyboardMarkup, None]:
     """
-    Отметка о выполнении цели
+    Клавиатура сообщения без кнопки отмеченной цели (None, если кнопок не осталось)
     """
 
-    extra_data = callback.json['extra_data']
-    user = extra_data['user']
-    session = extra_data['session']
+    rows = [[button for button in row if button.callback_data != callback_data] for row in markup.keyboard]
+    rows = [row for row in rows if row]
+    if not rows:
+        return None
+
+    new_markup = types.InlineKeyboardMarkup()
+    for row in rows:
+        new_markup.row(*row)
+    return new_markup
+
+
+@router.callback('habit')
+@timed(bot_handler_duration, 'mark_habit_handler')
+async def mark_habit_handler(callback: CallbackQuery, user: UserIdentity, session: AsyncSession) -> None:
+    """
+    Отметка о выполнении цели
+
+    Результат показывается во всплывающем ответе на нажатие, а кнопка отмеченной цели убирается
+    из клавиатуры исходного сообщения (списка /mark или напоминания), чтобы её не нажимали повторно.
+    Отдельное сообщение отправляется только при завершении работы над привычкой
+    """
 
     _, habit_id = callback.data.split('#')
     habit = await mark_habit(session=session, habit_id=int(habit_id), user_id=user.id)
     if habit and habit.completed_date:
-        await bot.send_message(
-            callback.message.chat.id, f'Поздравляем! 👏 Вы закончили работу над привычкой "{habit.title}". 💪'
-        )
+        answer_callback(callback.id, text='🏆 Привычка выработана!')
+        send_message(callback.message.chat.id, f'Поздравляем! 👏 Вы закончили работу над привычкой "{habit.title}". 💪')
     elif habit:
-        await bot.send_message(
-            callback.message.chat.id, f'Вы выполнили цель по работе над привычкой "{habit.title}". Так держать! 👍'
-        )
+        text = f'✅ Отмечено: "{habit.title}". Так держать! 👍'
+        if habit.current_streak:
+            text += f' Дней подряд: {habit.current_streak} (рекорд: {habit.best_streak}).'
+        answer_callback(callback.id, text=text)
     else:
-        await bot.send_message(callback.message.chat.id, '❗ Что-то пошло не так ')
+        answer_callback(callback.id, text='❗ Цель на сегодня уже отмечена или недоступна')
+
+    # Кнопка убирается и в случае неудачи: цель уже отмечена или недоступна
+    markup = callback.message.reply_markup
+    if markup and any(button.callback_data == callback.data for row in markup.keyboard for button in row):
+        send_queue.put(
+            callback.message.chat.id,
+            'edit_message_reply_markup',
+            message_id=callback.message.message_id,
+            reply_markup=remove_habit_button(markup, callback_data=callback.data),
+        )
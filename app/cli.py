@@ -0,0 +1,60 @@
+"""
+Служебные команды приложения
+
+Запуск:
+    python -m app.cli reconcile-alerts
+    python -m app.cli remove-webhook
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from dataclasses import asdict
+
+from app.database import engine
+from app.services import reconcile_alerts
+
+
+async def run_reconcile_alerts() -> dict:
+    try:
+        report = await reconcile_alerts()
+    finally:
+        await engine.dispose()
+
+    return asdict(report)
+
+
+async def run_remove_webhook() -> dict:
+    """
+    Отключение webhook бота (например, перед выводом из эксплуатации всех процессов приложения)
+    """
+
+    from app.bot import bot
+
+    try:
+        removed = await bot.remove_webhook()
+    finally:
+        await bot.close_session()
+
+    return {'removed': removed}
+
+
+COMMANDS = {
+    'reconcile-alerts': run_reconcile_alerts,
+    'remove-webhook': run_remove_webhook,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS, help='выполняемая команда')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = asyncio.run(COMMANDS[args.command]())
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
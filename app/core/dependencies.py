@@ -1,8 +1,35 @@
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import async_session
 
 
+class LazySession:
+    """
+    Сессия базы данных, которая создаётся при первом обращении к ней
+
+    Запросы, которым база данных не понадобилась (например, повторно доставленные или
+    не обрабатываемые ботом обновления), не создают сессию и не занимают соединение из пула
+    """
+
+    def __init__(self) -> None:
+        self._session: Union[AsyncSession, None] = None
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = async_session()
+        return getattr(self._session, name)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
 async def get_session() -> AsyncGenerator:
-    async with async_session() as session:
+    session = LazySession()
+    try:
         yield session
+    finally:
+        await session.close()
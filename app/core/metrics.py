@@ -0,0 +1,210 @@
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Callable, Iterator
+
+# Границы корзин гистограмм по умолчанию (в секундах)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric(ABC):
+    """
+    Метрика в формате Prometheus с набором меток
+
+    Значения хранятся в памяти процесса, обновление значения - одна операция со словарём,
+    поэтому метрики можно не отключать под нагрузкой
+    """
+
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, Any] = {}
+        registry.register(self)
+
+    @abstractmethod
+    def _new_value(self) -> Any:
+        pass
+
+    def labels(self, *labelvalues: str) -> Any:
+        value = self._values.get(labelvalues)
+        if value is None:
+            value = self._values[labelvalues] = self._new_value()
+        return value
+
+    @abstractmethod
+    def _samples(self, labelvalues: tuple, value: Any) -> Iterator[str]:
+        pass
+
+    def collect(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        for labelvalues, value in list(self._values.items()):
+            yield from self._samples(labelvalues, value)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_value(self) -> _Value:
+        return _Value()
+
+    def _samples(self, labelvalues: tuple, value: _Value) -> Iterator[str]:
+        yield f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value.value)}'
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: tuple) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+
+    def _new_value(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def _samples(self, labelvalues: tuple, value: _HistogramValue) -> Iterator[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, labelvalues, extra=f'le="{_format_value(bound)}"')
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labelnames, labelvalues)
+        yield f'{self.name}_sum{labels} {_format_value(value.sum)}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    """
+    Набор метрик приложения и показателей компонентов, собираемых в момент запроса метрик
+    """
+
+    def __init__(self) -> None:
+        self._metrics: list[Metric] = []
+        self._stats: list[tuple[str, Callable[[], dict]]] = []
+
+    def register(self, metric: Metric) -> None:
+        self._metrics.append(metric)
+
+    def register_stats(self, prefix: str, stats: Callable[[], dict]) -> None:
+        """
+        Экспорт числовых показателей из словаря stats() в виде gauge-метрик с префиксом prefix
+        """
+
+        self._stats.append((prefix, stats))
+
+    def _collect_stats(self, prefix: str, stats: dict) -> Iterator[str]:
+        for key, value in stats.items():
+            name = f'{prefix}_{key}'
+            if isinstance(value, dict):
+                yield from self._collect_stats(name, value)
+            elif isinstance(value, (int, float)):
+                yield f'# TYPE {name} gauge'
+                yield f'{name} {_format_value(value)}'
+
+    def render(self) -> str:
+        """
+        Метрики в текстовом формате Prometheus
+        """
+
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for prefix, stats in self._stats:
+            lines.extend(self._collect_stats(prefix, stats()))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def timed(histogram: Histogram, *labelvalues: str) -> Callable:
+    """
+    Декоратор для учёта длительности выполнения асинхронной функции в гистограмме
+    """
+
+    value = histogram.labels(*labelvalues)
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                value.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+# Обработка обновлений от Telegram
+webhook_updates = Counter('habitbot_webhook_updates_total', 'Updates received by webhook', ('result',))
+update_duration = Histogram('habitbot_update_duration_seconds', 'Update processing time', ('type',))
+bot_handler_duration = Histogram('habitbot_bot_handler_duration_seconds', 'Bot handler time', ('handler',))
+
+# База данных
+sql_duration = Histogram('habitbot_sql_statement_duration_seconds', 'SQL statement execution time')
+habit_service_duration = Histogram(
+    'habitbot_habit_service_duration_seconds', 'Habit service function time (mostly SQL)', ('function',)
+)
+
+# Telegram Bot API
+telegram_request_duration = Histogram(
+    'habitbot_telegram_request_duration_seconds', 'Telegram Bot API request time', ('method',)
+)
+telegram_request_errors = Counter(
+    'habitbot_telegram_request_errors_total', 'Failed Telegram Bot API requests', ('method', 'code')
+)
+
+# Планировщик
+job_duration = Histogram(
+    'habitbot_job_duration_seconds', 'Scheduled job time', ('job',), buckets=DEFAULT_BUCKETS + (30.0, 60.0)
+)
+job_errors = Counter('habitbot_job_errors_total', 'Failed or missed scheduled jobs', ('job', 'event'))
+alert_lateness = Histogram(
+    'habitbot_alert_lateness_seconds',
+    'Delay between habit alert time and alert delivery',
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0),
+)
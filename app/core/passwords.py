@@ -0,0 +1,104 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Union
+
+from passlib.hash import pbkdf2_sha256
+
+from app.settings import (
+    PASSWORD_HASH_EXECUTOR,
+    PASSWORD_HASH_MAX_IN_FLIGHT,
+    PASSWORD_HASH_ROUNDS,
+    PASSWORD_HASH_WORKERS,
+)
+
+# Количество раундов хранится в самом хэше, поэтому его изменение не влияет на проверку уже сохранённых паролей
+_hasher = pbkdf2_sha256.using(rounds=PASSWORD_HASH_ROUNDS) if PASSWORD_HASH_ROUNDS else pbkdf2_sha256
+
+_executor: Union[Executor, None] = None
+_semaphore: Union[asyncio.Semaphore, None] = None
+
+_stats = {operation: {'count': 0, 'total': 0.0, 'max': 0.0} for operation in ('hash', 'verify')}
+_in_flight = 0
+
+
+def _hash(password: str) -> str:
+    return _hasher.hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return _hasher.verify(password, password_hash)
+
+
+def _get_executor() -> Executor:
+    global _executor
+
+    if _executor is None:
+        if PASSWORD_HASH_EXECUTOR == 'process':
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    return _executor
+
+
+async def _run(operation: str, func: Callable, *args: Any) -> Any:
+    global _semaphore, _in_flight
+
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(PASSWORD_HASH_MAX_IN_FLIGHT)
+
+    # Ограничение числа одновременно выполняемых вычислений, остальные запросы ожидают своей очереди
+    async with _semaphore:
+        _in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+        finally:
+            _in_flight -= 1
+            duration = time.perf_counter() - started
+            stats = _stats[operation]
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['max'] = max(stats['max'], duration)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Вычисление хэша пароля вне цикла событий
+    """
+
+    return await _run('hash', _hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Проверка пароля по хэшу вне цикла событий
+    """
+
+    return await _run('verify', _verify, password, password_hash)
+
+
+def shutdown_password_executor() -> None:
+    """
+    Остановка пула вычисления хэшей паролей
+    """
+
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def get_password_hash_stats() -> dict:
+    """
+    Количество и длительность (в секундах) вычислений хэшей паролей
+    """
+
+    return {
+        'in_flight': _in_flight,
+        **{
+            operation: {**stats, 'avg': stats['total'] / stats['count'] if stats['count'] else 0.0}
+            for operation, stats in _stats.items()
+        },
+    }
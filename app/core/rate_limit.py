@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов по алгоритму "корзины токенов"
+
+    rate - скорость пополнения (токенов в секунду)
+    capacity - максимальный запас токенов (допустимый всплеск)
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        """
+        Корзина заполнена и её можно безболезненно удалить
+        """
+
+        self._refill()
+        return self._tokens >= self.capacity and not self._lock.locked()
+
+    async def acquire(self) -> None:
+        """
+        Ожидание и получение одного токена (ожидающие обслуживаются по очереди)
+        """
+
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def delay(self) -> float:
+        """
+        Время до появления токена в секундах (0, если токен есть)
+        """
+
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """
+        Получение токена без ожидания (False, если токена нет)
+        """
+
+        self._refill()
+        if self._tokens < 1 or self._lock.locked():
+            return False
+        self._tokens -= 1
+        return True
+
+    def pause(self, seconds: float) -> None:
+        """
+        Приостановка выдачи токенов на указанное время (например, по retry_after от Telegram)
+        """
+
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
@@ -0,0 +1,132 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Union
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+# Обработчик получает разобранное сообщение или нажатие кнопки, пользователя и сессию базы данных
+Handler = Callable[..., Awaitable[Any]]
+
+
+@dataclass(frozen=True, slots=True)
+class Chat:
+    id: int
+
+
+@dataclass(frozen=True, slots=True)
+class Message:
+    """
+    Сообщение из обновления Telegram: только поля, которые используют обработчики
+    """
+
+    message_id: int
+    chat: Chat
+    text: str
+    # Клавиатура разбирается только при обращении (нужна только обработчикам нажатий кнопок)
+    reply_markup_data: Union[dict, None] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Message':
+        return cls(
+            message_id=data['message_id'],
+            chat=Chat(id=data['chat']['id']),
+            text=data.get('text', ''),
+            reply_markup_data=data.get('reply_markup'),
+        )
+
+    @property
+    def reply_markup(self) -> Union[types.InlineKeyboardMarkup, None]:
+        if self.reply_markup_data is None:
+            return None
+        return types.InlineKeyboardMarkup.de_json(self.reply_markup_data)
+
+
+@dataclass(frozen=True, slots=True)
+class CallbackQuery:
+    """
+    Нажатие inline-кнопки из обновления Telegram: только поля, которые используют обработчики
+    """
+
+    id: str
+    data: str
+    message: Message
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'CallbackQuery':
+        return cls(id=data['id'], data=data['data'], message=Message.from_dict(data['message']))
+
+
+def get_command(text: str) -> Union[str, None]:
+    """
+    Имя команды из текста сообщения ("/mark", "/mark@HabitBot", "/timezone Europe/Berlin")
+    """
+
+    if not text.startswith('/'):
+        return None
+    return text.split(maxsplit=1)[0].split('@', 1)[0][1:]
+
+
+class UpdateRouter:
+    """
+    Маршрутизация обновлений Telegram по таблицам обработчиков, заполняемым при импорте модуля бота
+
+    Обработчик команды выбирается по имени команды, обработчик нажатия кнопки - по префиксу callback-данных
+    до первого символа "#", поэтому выбор не зависит от количества обработчиков. Исходное обновление
+    не изменяется, пользователь и сессия передаются обработчику аргументами
+    """
+
+    def __init__(self) -> None:
+        self._commands: dict[str, Handler] = {}
+        self._callbacks: dict[str, Handler] = {}
+
+    def command(self, *names: str) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            for name in names:
+                self._commands[name] = handler
+            return handler
+
+        return decorator
+
+    def callback(self, prefix: str) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            self._callbacks[prefix] = handler
+            return handler
+
+        return decorator
+
+    def resolve(self, data: dict) -> Union[tuple[Handler, Union[Message, CallbackQuery]], None]:
+        """
+        Обработчик обновления и разобранные данные для него (None, если обработчика нет)
+        """
+
+        if message := data.get('message'):
+            command = get_command(message.get('text', ''))
+            if command is not None and (handler := self._commands.get(command)):
+                return handler, Message.from_dict(message)
+        elif (callback_query := data.get('callback_query')) and 'message' in callback_query:
+            prefix, separator, _ = callback_query.get('data', '').partition('#')
+            if separator and (handler := self._callbacks.get(prefix)):
+                return handler, CallbackQuery.from_dict(callback_query)
+        return None
+
+    async def dispatch(self, data: dict, **kwargs: Any) -> bool:
+        """
+        Обработка обновления подходящим обработчиком
+
+        Ошибка обработчика записывается в журнал и не прерывает обработку следующих обновлений.
+        Возвращает False, если обработчика для обновления нет
+        """
+
+        resolved = self.resolve(data)
+        if resolved is None:
+            return False
+
+        handler, event = resolved
+        try:
+            await handler(event, **kwargs)
+        # Как и в telebot, ошибка одного обработчика не должна останавливать обработчик очереди обновлений
+        except Exception:  # noqa: PIE786
+            logger.exception('Handler %s failed on update %s', handler.__name__, data.get('update_id'))
+        return True
@@ -1,3 +1,32 @@
+import hashlib
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from starlette.templating import Jinja2Templates
 
-templates = Jinja2Templates(directory='app/templates')
+from app.settings import JINJA_BYTECODE_CACHE_DIR
+
+TEMPLATES_DIR = Path('app/templates')
+
+# Скомпилированные шаблоны сохраняются на диск, поэтому после перезапуска они не компилируются заново
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR),
+        autoescape=True,
+        bytecode_cache=FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR),
+    )
+)
+
+
+def get_templates_version() -> str:
+    """
+    Контрольная сумма шаблонов, меняется при их изменении (используется в ETag страниц)
+    """
+
+    digest = hashlib.sha1()
+    for path in sorted(TEMPLATES_DIR.glob('*.html')):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+templates_version = get_templates_version()
@@ -1,9 +1,49 @@
-from datetime import datetime
+from datetime import date, datetime, time
+from functools import lru_cache
+from typing import Any
 
 import pytz
+from sqlalchemy import ColumnElement, Date, DateTime, cast, func
 
 from app.settings import TZ
 
 
-def aware_now() -> datetime:
-    return datetime.now(pytz.timezone(TZ))
+@lru_cache(maxsize=None)
+def get_zone(name: str) -> pytz.BaseTzInfo:
+    """
+    Часовой пояс по имени (объекты часовых поясов создаются один раз на процесс)
+    """
+
+    return pytz.timezone(name)
+
+
+def is_valid_zone(name: str) -> bool:
+    return name in pytz.all_timezones_set
+
+
+def aware_now(tz: str = TZ) -> datetime:
+    return datetime.now(get_zone(tz))
+
+
+def localize(tz: str, day: date, at: time) -> datetime:
+    """
+    Момент времени в UTC, соответствующий местным дате и времени в часовом поясе tz
+    """
+
+    return get_zone(tz).localize(datetime.combine(day, at)).astimezone(pytz.utc)
+
+
+def sql_localize(tz: Any, day: Any, at: Any) -> ColumnElement:
+    """
+    Выражение SQL: момент времени в UTC, соответствующий местным дате и времени в часовом поясе tz
+    """
+
+    return func.timezone(tz, day + at, type_=DateTime(timezone=True))
+
+
+def sql_local_date(tz: Any) -> ColumnElement:
+    """
+    Выражение SQL: текущая дата в часовом поясе tz
+    """
+
+    return cast(func.timezone(tz, func.now()), Date)
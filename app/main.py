@@ -1,26 +1,86 @@
+import secrets
 from contextlib import asynccontextmanager
 
+from apscheduler.schedulers.base import STATE_RUNNING
 from apscheduler.triggers.cron import CronTrigger
-from fastapi import APIRouter, FastAPI, Request
+from fastapi import APIRouter, Depends, FastAPI, Request
 from pydantic_core import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
-from starlette.responses import JSONResponse
-
-from app.services import scheduler, summarize_daily_results
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+
+from app.core.dependencies import get_session
+from app.core.metrics import registry
+from app.core.passwords import get_password_hash_stats, shutdown_password_executor
+from app.core.utils import aware_now
+from app.database import get_pool_stats
+from app.services import (
+    agenda_cache,
+    dispatch_alerts,
+    get_current_leader,
+    instance_name,
+    leader,
+    prune_processed_updates,
+    recent_updates,
+    reconcile_alerts,
+    scheduler,
+    send_queue,
+    summarize_daily_results,
+    update_pool,
+    user_cache,
+)
 from app.settings import (
     HOST,
+    METRICS_TOKEN,
+    WEBHOOK_ASYNC_PROCESSING,
+    WEBHOOK_DEDUP_BACKEND,
 )
 from app.webapp import authentication_router, habits_router, webhook_router
 
 
+def resume_scheduler() -> None:
+    """
+    Возобновление задач планировщика в процессе, ставшем ведущим
+
+    Подведение итогов запускается сразу, чтобы догнать запуски, пропущенные при смене ведущего процесса.
+    Сверка состояния напоминаний с целями выполняется один раз новым ведущим процессом, а не каждым процессом
+    при запуске
+    """
+
+    scheduler.resume()
+    scheduler.add_job(reconcile_alerts, id='reconcile_alerts', next_run_time=aware_now(), replace_existing=True)
+    scheduler.modify_job('summarize_daily_results', next_run_time=aware_now())
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     from app.bot import bot
 
-    # Запуск планировщика задач
-    scheduler.start()
-    # Запуск периодической задачи по подведению итогов за прошедший день
-    scheduler.add_job(summarize_daily_results, trigger=CronTrigger(hour=00, minute=5))
+    # Запуск очереди исходящих сообщений
+    await send_queue.start()
+    # Запуск фоновых обработчиков обновлений от Telegram
+    if WEBHOOK_ASYNC_PROCESSING:
+        await update_pool.start()
+    # Запуск планировщика задач в приостановленном состоянии, задачи выполняет только ведущий процесс
+    scheduler.start(paused=True)
+    # Запуск периодической задачи по подведению итогов за прошедший день (по мере наступления полуночи
+    # в часовых поясах пользователей, в том числе со смещением на полчаса и четверть часа)
+    scheduler.add_job(
+        summarize_daily_results,
+        trigger=CronTrigger(minute='5,20,35,50'),
+        id='summarize_daily_results',
+        replace_existing=True,
+    )
+    # Запуск ежеминутной рассылки напоминаний
+    scheduler.add_job(dispatch_alerts, trigger=CronTrigger(minute='*'), id='dispatch_alerts', replace_existing=True)
+    # Запуск периодической очистки идентификаторов обработанных обновлений
+    if WEBHOOK_DEDUP_BACKEND == 'postgres':
+        scheduler.add_job(
+            prune_processed_updates, trigger=CronTrigger(minute=30), id='prune_processed_updates', replace_existing=True
+        )
+    # Выбор ведущего процесса среди процессов приложения
+    await leader.start(on_elected=resume_scheduler, on_demoted=scheduler.pause)
     # Передача URL для webhook бота
     await bot.set_webhook(url=f'{HOST}/webhook')
 
@@ -28,10 +88,17 @@ async def lifespan(app: FastAPI):
 
     #  after the application finishes handling requests, right before the shutdown
 
-    # Остановка планировщика задач
+    # Передача роли ведущего процесса другому процессу и остановка планировщика задач
+    await leader.stop()
     scheduler.shutdown()
-    # Отключаем webhook бота
-    await bot.remove_webhook()
+    # Обработка накопившихся обновлений и остановка обработчиков
+    await update_pool.stop()
+    # Отправка накопившихся сообщений и остановка очереди
+    await send_queue.stop()
+    # Остановка пула вычисления хэшей паролей
+    shutdown_password_executor()
+    # Webhook бота не отключается: остальные процессы и контейнеры продолжают принимать обновления.
+    # Отключить его можно отдельно командой app.cli remove-webhook
 
 
 # Отключаем документирование, так как API не для внешнего пользования
@@ -46,6 +113,56 @@ router.include_router(habits_router)
 
 app.include_router(router)
 
+# Показатели компонентов приложения, собираемые при запросе метрик
+registry.register_stats('habitbot_send_queue', send_queue.stats)
+registry.register_stats('habitbot_update_pool', update_pool.stats)
+registry.register_stats('habitbot_recent_updates', recent_updates.stats)
+registry.register_stats('habitbot_user_cache', user_cache.stats)
+registry.register_stats('habitbot_agenda_cache', agenda_cache.stats)
+registry.register_stats('habitbot_db_pool', get_pool_stats)
+registry.register_stats('habitbot_password_hash', get_password_hash_stats)
+registry.register_stats('habitbot_leader', leader.stats)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics(request: Request) -> Response:
+    """
+    Метрики приложения в формате Prometheus
+
+    Адрес доступен из интернета вместе с webhook, поэтому метрики отдаются только по токену METRICS_TOKEN
+    (если токен не задан, адрес отключён)
+    """
+
+    if not METRICS_TOKEN:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    authorization = request.headers.get('Authorization', '')
+    if not secrets.compare_digest(authorization.encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+        return Response(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/health', include_in_schema=False)
+async def health(session: AsyncSession = Depends(get_session)) -> JSONResponse:
+    """
+    Состояние процесса приложения: является ли он ведущим (выполняет задачи планировщика)
+    и какой процесс ведущий сейчас
+    """
+
+    content = {
+        'instance': instance_name,
+        'leader': leader.is_leader,
+        'leader_since': leader.leader_since.isoformat() if leader.leader_since else None,
+        'scheduler': 'running' if scheduler.state == STATE_RUNNING else 'paused',
+    }
+    try:
+        content['current_leader'] = await get_current_leader(session=session)
+    except (SQLAlchemyError, OSError):
+        content['database'] = 'unavailable'
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=content)
+
+    return JSONResponse(content=content)
+
 
 @app.exception_handler(ValidationError)
 def validation_exception_handler(request: Request, exc: ValidationError):
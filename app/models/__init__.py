@@ -1,9 +1,16 @@
 from typing import Any, List
 
+from .checkin import HabitCheckin, HabitStats
 from .habit import Habit
+from .rollover import RolloverCheckpoint
+from .update import ProcessedUpdate
 from .user import User
 
 __all__: List[Any] = [
     User,
     Habit,
+    ProcessedUpdate,
+    HabitCheckin,
+    HabitStats,
+    RolloverCheckpoint,
 ]
@@ -0,0 +1,62 @@
+from datetime import date, datetime
+
+from sqlalchemy import (
+    BigInteger,
+    CheckConstraint,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    func,
+)
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+
+class HabitCheckin(Base):
+    """
+    История выполнения целей по дням (записи только добавляются)
+    """
+
+    __tablename__ = 'habit_checkin'
+
+    DONE = 'done'
+    MISSED = 'missed'
+
+    id: Mapped[int] = mapped_column('id', type_=BigInteger, primary_key=True)
+    habit_id: Mapped[int] = mapped_column(Integer, ForeignKey('habit.id', ondelete='CASCADE'), nullable=False)
+    checkin_date: Mapped[date] = mapped_column('checkin_date', type_=Date, nullable=False)
+    outcome: Mapped[str] = mapped_column('outcome', type_=String(16), nullable=False)
+    created_at: Mapped[datetime] = mapped_column('created_at', type_=DateTime(timezone=True), server_default=func.now())
+    # Часть подведения итогов дня (rollover_checkpoint), в которой записан пропуск (NULL - отметка пользователя)
+    checkpoint_id: Mapped[int] = mapped_column('checkpoint_id', type_=BigInteger, nullable=True)
+
+    __table_args__ = (
+        # Не более одной отметки за день, индекс также используется для выборки истории цели
+        UniqueConstraint('habit_id', 'checkin_date', name='uq_habit_checkin_habit_id_checkin_date'),
+        CheckConstraint(outcome.in_([DONE, MISSED]), name='check_outcome'),
+        # Пропуски части подведения итогов для повторной отправки уведомлений (get_unnotified_habits)
+        Index('ix_habit_checkin_checkpoint_id', checkpoint_id, postgresql_where=checkpoint_id.is_not(None)),
+    )
+
+
+class HabitStats(Base):
+    """
+    Статистика выполнения цели, обновляется вместе с добавлением записи в историю
+    """
+
+    __tablename__ = 'habit_stats'
+
+    habit_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('habit.id', ondelete='CASCADE'), primary_key=True, autoincrement=False
+    )
+    # Количество дней подряд, в которые цель выполнялась
+    current_streak: Mapped[int] = mapped_column('current_streak', type_=Integer, default=0, server_default='0')
+    best_streak: Mapped[int] = mapped_column('best_streak', type_=Integer, default=0, server_default='0')
+    completions: Mapped[int] = mapped_column('completions', type_=Integer, default=0, server_default='0')
+    misses: Mapped[int] = mapped_column('misses', type_=Integer, default=0, server_default='0')
+    last_checkin_date: Mapped[date] = mapped_column('last_checkin_date', type_=Date, nullable=True)
@@ -1,6 +1,15 @@
-from datetime import date, time
+from datetime import date, datetime, time
 
-from sqlalchemy import CheckConstraint, Date, ForeignKey, Integer, String, Time
+from sqlalchemy import (
+    CheckConstraint,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Time,
+)
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .user import Base
@@ -18,8 +27,28 @@ class Habit(Base):
     alert_time: Mapped[time] = mapped_column('alert_time', type_=Time, nullable=False)
     alert_date: Mapped[date] = mapped_column('alert_date', type_=Date, nullable=True)
     completed_date: Mapped[date] = mapped_column('completed_date', type_=Date, nullable=True)
+    # Дата, за которую уже отправлено напоминание
+    alerted_date: Mapped[date] = mapped_column('alerted_date', type_=Date, nullable=True)
+    # Момент напоминания за день alert_date в UTC (alert_date и alert_time - в часовом поясе пользователя)
+    alert_at: Mapped[datetime] = mapped_column('alert_at', type_=DateTime(timezone=True), nullable=True)
 
-    __table_args__ = (CheckConstraint(target > 0, name='check_target_positive'),)
+    __table_args__ = (
+        CheckConstraint(target > 0, name='check_target_positive'),
+        # Цели пользователя на день (get_actual_habits, mark_habit)
+        Index('ix_habit_user_id_alert_date', user_id, alert_date),
+        # Активные цели пользователя (get_active_habits)
+        Index('ix_habit_user_id_active', user_id, postgresql_where=completed_date.is_(None)),
+        # Выполненные цели пользователя постранично (get_completed_habits)
+        Index(
+            'ix_habit_user_id_completed_date_id',
+            user_id,
+            completed_date,
+            id,
+            postgresql_where=completed_date.is_not(None),
+        ),
+        # Напоминания и подведение итогов дня
+        Index('ix_habit_alert_at', alert_at, postgresql_where=completed_date.is_(None)),
+    )
 
     @property
     def days_left(self) -> int:
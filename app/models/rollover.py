@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, Integer, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+
+class RolloverCheckpoint(Base):
+    """
+    Отметка о завершении части (диапазона пользователей) подведения итогов дня
+
+    Отметка добавляется в транзакции сброса целей, а записи о пропусках в habit_checkin ссылаются на неё
+    по checkpoint_id. По ней уведомления, не отправленные из-за перезапуска, отправляются позже
+    """
+
+    __tablename__ = 'rollover_checkpoint'
+
+    id: Mapped[int] = mapped_column('id', type_=BigInteger, primary_key=True)
+    first_user_id: Mapped[int] = mapped_column('first_user_id', type_=Integer, nullable=False)
+    last_user_id: Mapped[int] = mapped_column('last_user_id', type_=Integer, nullable=False)
+    reset: Mapped[int] = mapped_column('reset', type_=Integer, nullable=False)
+    reset_at: Mapped[datetime] = mapped_column(
+        'reset_at', type_=DateTime(timezone=True), server_default=func.now(), nullable=False, index=True
+    )
+    notified: Mapped[int] = mapped_column('notified', type_=Integer, default=0, server_default='0')
+    # Время окончания отправки уведомлений (NULL - уведомления ещё не отправлены)
+    notified_at: Mapped[datetime] = mapped_column('notified_at', type_=DateTime(timezone=True), nullable=True)
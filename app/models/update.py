@@ -0,0 +1,15 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+
+class ProcessedUpdate(Base):
+    __tablename__ = 'processed_update'
+
+    update_id: Mapped[int] = mapped_column('update_id', type_=BigInteger, primary_key=True, autoincrement=False)
+    received_at: Mapped[datetime] = mapped_column(
+        'received_at', type_=DateTime(timezone=True), server_default=func.now(), index=True
+    )
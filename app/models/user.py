@@ -2,6 +2,7 @@ from sqlalchemy import Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.database import Base
+from app.settings import TZ
 
 
 class User(Base):
@@ -14,6 +15,12 @@ class User(Base):
     last_name: Mapped[str] = mapped_column('last_name', type_=String)
     access_token: Mapped[str] = mapped_column('access_token', type_=String)
     refresh_token: Mapped[str] = mapped_column('refresh_token', type_=String)
+    # Номер поколения токенов, увеличивается при каждом входе, отзывая ранее выданные токены
+    token_version: Mapped[int] = mapped_column('token_version', type_=Integer, default=0, server_default='0')
+    # Номер версии списка целей, увеличивается при каждом изменении целей пользователя
+    habits_version: Mapped[int] = mapped_column('habits_version', type_=Integer, default=0, server_default='0')
+    # Часовой пояс пользователя: даты целей и время напоминаний - местные
+    timezone: Mapped[str] = mapped_column('timezone', type_=String, default=TZ, server_default=TZ)
 
     @property
     def name(self):
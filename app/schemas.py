@@ -43,3 +43,19 @@ class HabitForm(BaseModel):
         alert_time: datetime.time = Form(...),
     ) -> BaseModel:
         return cls(title=title, description=description, target=target, alert_time=alert_time)
+
+
+class HabitImportRow(HabitForm):
+    """
+    Строка импорта целей: поля формы цели, а также прогресс и дата выполнения (при переносе архива)
+    """
+
+    target: int = Field(gt=0)
+    process: int = Field(default=0, ge=0)
+    completed_date: Union[datetime.date, None] = None
+
+    @model_validator(mode='after')
+    def check_process(self) -> Self:
+        if self.completed_date is None and self.process >= self.target:
+            raise ValueError('Прогресс незавершённой цели должен быть меньше количества дней')
+        return self
@@ -3,6 +3,7 @@ from typing import Any, List
 from .authentication import (
     authenticate,
     authorize,
+    authorize_access,
     check_password,
     check_token,
     generate_user_tokens,
@@ -10,28 +11,45 @@ from .authentication import (
 )
 from .bot_keybord import get_markup
 from .daily_results import summarize_daily_results
+from .deduplication import (
+    forget_update,
+    prune_processed_updates,
+    recent_updates,
+    register_update,
+)
 from .habit import (
+    agenda_cache,
+    bump_habits_version,
     create_habit,
     delete_habit,
     get_active_habits,
     get_actual_habits,
     get_completed_habits,
     get_habit,
+    get_habits_version,
+    invalidate_agenda,
     mark_habit,
     update_habit,
 )
-from .notification import (
-    add_job_by_datetime,
-    alert,
-    delete_job,
-    scheduler,
-    update_job_datetime,
+from .leadership import get_current_leader, instance_name, leader
+from .notification import alert, dispatch_alerts, scheduler
+from .reconciliation import reconcile_alerts
+from .sender import answer_callback, send_message, send_queue
+from .updates import process_update, update_pool
+from .user import (
+    get_or_create_user,
+    get_user,
+    get_user_identity,
+    get_user_timezone,
+    invalidate_user,
+    set_user_timezone,
+    user_cache,
 )
-from .user import get_or_create_user, get_user
 
 __all__: List[Any] = [
     authenticate,
     authorize,
+    authorize_access,
     generate_user_tokens,
     set_user_password,
     check_password,
@@ -39,9 +57,8 @@ __all__: List[Any] = [
     get_markup,
     scheduler,
     alert,
-    add_job_by_datetime,
-    update_job_datetime,
-    delete_job,
+    dispatch_alerts,
+    reconcile_alerts,
     create_habit,
     delete_habit,
     get_active_habits,
@@ -50,7 +67,28 @@ __all__: List[Any] = [
     get_habit,
     update_habit,
     mark_habit,
+    bump_habits_version,
+    get_habits_version,
+    agenda_cache,
+    invalidate_agenda,
     get_or_create_user,
     get_user,
+    get_user_identity,
+    get_user_timezone,
+    set_user_timezone,
+    invalidate_user,
+    user_cache,
     summarize_daily_results,
+    send_queue,
+    send_message,
+    answer_callback,
+    process_update,
+    update_pool,
+    register_update,
+    forget_update,
+    recent_updates,
+    prune_processed_updates,
+    leader,
+    instance_name,
+    get_current_leader,
 ]
@@ -2,12 +2,20 @@ from typing import Union
 
 import jwt
 from jwt import DecodeError
-from passlib.hash import pbkdf2_sha256
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
+from app.core.passwords import hash_password, verify_password
 from app.core.utils import aware_now
 from app.models import User
-from app.services.user import get_or_create_user, get_user
+from app.services.user import (
+    UserIdentity,
+    cache_user,
+    get_or_create_user,
+    get_token_version,
+    get_user,
+)
 from app.settings import (
     DATETIME_FORMAT,
     EXPIRE_ACCESS_TOKEN,
@@ -17,7 +25,7 @@ from app.settings import (
 )
 
 
-async def authenticate(session: AsyncSession, data: dict) -> Union[User, None]:
+async def authenticate(session: AsyncSession, data: dict) -> Union[UserIdentity, None]:
     """
     Аутентификация пользователя, по данным полученным от Телеграм
     """
@@ -41,6 +49,20 @@ async def authorize(
             return user
 
 
+async def authorize_access(session: AsyncSession, user_id: int, token: Union[str, None]) -> bool:
+    """
+    Авторизация пользователя для работы с webapp по access-токену
+
+    Подписи и срока действия токена достаточно, чтобы ему доверять, поэтому пользователь не загружается.
+    Отзыв токенов выполняется через номер поколения токенов пользователя, который хранится в кэше
+    """
+
+    if not token or not (token_data := decode_token(token=token)) or token_data['user_id'] != user_id:
+        return False
+
+    return token_data.get('ver') == await get_token_version(session=session, user_id=user_id)
+
+
 async def generate_user_tokens(session: AsyncSession, user: User) -> None:
     """
     Генерация токенов пользователя для доступа к webapp
@@ -48,20 +70,32 @@ async def generate_user_tokens(session: AsyncSession, user: User) -> None:
 
     expire_access_token = (aware_now() + EXPIRE_ACCESS_TOKEN).strftime(format=DATETIME_FORMAT)
     expire_refresh_token = (aware_now() + EXPIRE_REFRESH_TOKEN).strftime(format=DATETIME_FORMAT)
+    # Новое поколение токенов отзывает все ранее выданные. Номер увеличивается в базе данных: одновременные
+    # входы получают разные номера, и принимается только пара токенов последнего из них
+    res = await session.execute(
+        update(User)
+        .where(User.id == user.id)
+        .values(token_version=User.token_version + 1)
+        .returning(User.token_version)
+        .execution_options(synchronize_session=False)
+    )
+    token_version = res.scalar_one()
+    set_committed_value(user, 'token_version', token_version)
 
     user.access_token = jwt.encode(
-        {'user_id': user.id, 'username': user.username, 'date': expire_access_token},
+        {'user_id': user.id, 'username': user.username, 'date': expire_access_token, 'ver': token_version},
         SECRET_PYJWT_ACCESS_KEY,
         algorithm='HS256',
     )
     user.refresh_token = jwt.encode(
-        {'user_id': user.id, 'username': user.username, 'date': expire_refresh_token},
+        {'user_id': user.id, 'username': user.username, 'date': expire_refresh_token, 'ver': token_version},
         SECRET_PYJWT_REFRESH_KEY,
         algorithm='HS256',
     )
     await session.commit()
 
     await session.refresh(user)
+    cache_user(user)
 
 
 async def set_user_password(session: AsyncSession, user: User, password: str) -> User:
@@ -69,7 +103,7 @@ async def set_user_password(session: AsyncSession, user: User, password: str) ->
     Установка пароля пользователем
     """
 
-    password_hash = pbkdf2_sha256.hash(password)
+    password_hash = await hash_password(password)
     user.password = password_hash
 
     await generate_user_tokens(session=session, user=user)
@@ -77,12 +111,29 @@ async def set_user_password(session: AsyncSession, user: User, password: str) ->
     return user
 
 
-def check_password(user: User, password: str) -> bool:
+async def check_password(user: User, password: str) -> bool:
     """
     Проверка пароля пользователя
     """
 
-    return bool(user and user.password and pbkdf2_sha256.verify(password, user.password))
+    return bool(user and user.password and await verify_password(password, user.password))
+
+
+def decode_token(token: str, refresh: bool = False) -> Union[dict, None]:
+    """
+    Проверка подписи и срока действия токена
+
+    Возвращает данные токена или None, если токен недействителен
+    """
+
+    secret_token = SECRET_PYJWT_REFRESH_KEY if refresh else SECRET_PYJWT_ACCESS_KEY
+
+    try:
+        token_data = jwt.decode(token, secret_token, algorithms=['HS256'])
+        if token_data['date'] > aware_now().strftime(DATETIME_FORMAT) and isinstance(token_data['user_id'], int):
+            return token_data
+    except (DecodeError, KeyError, ValueError, TypeError):
+        pass
 
 
 def check_token(user: User, token: str, refresh: bool = False) -> bool:
@@ -93,19 +144,7 @@ def check_token(user: User, token: str, refresh: bool = False) -> bool:
     refresh=false - проверка access-токена
     """
 
-    if refresh:
-        secret_token = SECRET_PYJWT_REFRESH_KEY
-        token_from_db = user.refresh_token
-    else:
-        secret_token = SECRET_PYJWT_ACCESS_KEY
-        token_from_db = user.access_token
+    token_from_db = user.refresh_token if refresh else user.access_token
+    token_data = decode_token(token=token, refresh=refresh)
 
-    try:
-        token_data = jwt.decode(token, secret_token, algorithms=['HS256'])
-        return (
-            token_data['date'] > aware_now().strftime(DATETIME_FORMAT)
-            and token_data['user_id'] == user.id
-            and token == token_from_db
-        )
-    except (DecodeError, KeyError, ValueError):
-        return False
+    return bool(token_data and token_data['user_id'] == user.id and token == token_from_db)
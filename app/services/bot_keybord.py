@@ -9,6 +9,9 @@ from app.settings import HOST, REFRESH_TOKEN_NAME
 def get_markup(user: User) -> types.ReplyKeyboardMarkup:
     """
     Получение кнопки со ссылкой на главную страницу webapp в зависимости от состояния пользователя
+
+    Пароль и refresh-токен берутся из загруженного из базы данных пользователя: после входа в другом процессе
+    приложения кэшированный токен устарел бы
     """
 
     if not user.password:
@@ -0,0 +1,78 @@
+from datetime import date
+from typing import Union
+
+from sqlalchemy import CTE, BigInteger, ColumnElement, func, literal, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import HabitCheckin, HabitStats
+
+
+def build_checkin_ctes(
+    habits: CTE, checkin_date: Union[date, ColumnElement], outcome: str, checkpoint_id: Union[int, None] = None
+) -> tuple[CTE, CTE]:
+    """
+    Запросы добавления записи в историю и обновления статистики для целей из habits (CTE с полем id)
+
+    Дата отметки checkin_date - общая для всех целей или поле CTE habits (у целей из разных часовых поясов).
+    Запросы выполняются в составе запроса, изменяющего цели, поэтому история и статистика обновляются
+    в той же транзакции. Повторная отметка за тот же день не учитывается ни в истории, ни в статистике.
+    Статистику из CTE stats (habit_id, current_streak, best_streak) можно вернуть вместе с целями.
+    Записи о пропусках при подведении итогов дня помечаются частью подведения итогов checkpoint_id
+    """
+
+    done = outcome == HabitCheckin.DONE
+    if not isinstance(checkin_date, ColumnElement):
+        checkin_date = literal(checkin_date)
+
+    checkins = (
+        insert(HabitCheckin)
+        .from_select(
+            ['habit_id', 'checkin_date', 'outcome', 'checkpoint_id'],
+            select(habits.c.id, checkin_date, literal(outcome), literal(checkpoint_id, BigInteger)),
+        )
+        .on_conflict_do_nothing(index_elements=['habit_id', 'checkin_date'])
+        .cte('checkins')
+    )
+
+    stmt = insert(HabitStats).from_select(
+        ['habit_id', 'current_streak', 'best_streak', 'completions', 'misses', 'last_checkin_date'],
+        select(
+            habits.c.id,
+            literal(int(done)),
+            literal(int(done)),
+            literal(int(done)),
+            literal(int(not done)),
+            checkin_date,
+        ),
+    )
+    if done:
+        values = {
+            'current_streak': HabitStats.current_streak + 1,
+            'best_streak': func.greatest(HabitStats.best_streak, HabitStats.current_streak + 1),
+            'completions': HabitStats.completions + 1,
+        }
+    else:
+        values = {'current_streak': 0, 'misses': HabitStats.misses + 1}
+    stats = (
+        stmt.on_conflict_do_update(
+            index_elements=['habit_id'],
+            set_={**values, 'last_checkin_date': stmt.excluded.last_checkin_date},
+            where=or_(
+                HabitStats.last_checkin_date.is_(None), HabitStats.last_checkin_date < stmt.excluded.last_checkin_date
+            ),
+        )
+        .returning(HabitStats.habit_id, HabitStats.current_streak, HabitStats.best_streak)
+        .cte('stats')
+    )
+
+    return checkins, stats
+
+
+async def get_habit_stats(session: AsyncSession, habit_id: int) -> Union[HabitStats, None]:
+    """
+    Получение статистики выполнения цели
+    """
+
+    res = await session.execute(select(HabitStats).where(HabitStats.habit_id == habit_id))
+    return res.scalar_one_or_none()
@@ -1,36 +1,328 @@
-from datetime import timedelta
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Sequence
 
-from sqlalchemy import select
+from sqlalchemy import Row, Select, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.utils import aware_now
+from app.core.metrics import job_duration, timed
+from app.core.utils import aware_now, sql_local_date, sql_localize
 from app.database import async_session
-from app.models import Habit
-from app.services.notification import update_job_datetime
+from app.models import Habit, HabitCheckin, RolloverCheckpoint, User
+from app.services.checkin import build_checkin_ctes
+from app.services.habit import bump_habits_version, invalidate_agenda
+from app.services.sender import send_message
+from app.settings import (
+    ROLLOVER_CHECKPOINT_TTL,
+    ROLLOVER_CONCURRENCY,
+    ROLLOVER_NOTIFY_CONCURRENCY,
+    ROLLOVER_RESUME_WINDOW,
+    ROLLOVER_SHARD_SIZE,
+)
 
+logger = logging.getLogger(__name__)
 
-async def summarize_daily_results() -> None:
+
+@dataclass
+class ShardReport:
     """
-    Перенос невыполненных дневных целей
+    Отчёт о переносе целей пользователей из диапазона идентификаторов
     """
 
-    async with async_session() as session:
-        aware_date = aware_now().date() - timedelta(days=1)
+    first_user_id: int
+    last_user_id: int
+    reset: int = 0
+    notified: int = 0
+    failed: int = 0
+    duration: float = 0.0
+
+
+@dataclass
+class RolloverReport:
+    """
+    Отчёт о переносе невыполненных дневных целей
+    """
+
+    reset: int = 0
+    notified: int = 0
+    failed: int = 0
+    # Уведомления, дошедшие из частей, обработка которых прервалась перезапуском
+    resumed: int = 0
+    shards: list[ShardReport] = field(default_factory=list)
+    duration: float = 0.0
+
+
+def select_missed_habits(*columns) -> Select:
+    """
+    Выборка целей, день которых закончился в часовом поясе пользователя
+
+    Кандидаты выбираются по индексу моментов напоминаний, которые уже наступили, а дата цели сравнивается
+    с текущей датой в часовом поясе её пользователя. Поэтому каждый запуск обрабатывает только часовые пояса,
+    в которых с прошлого запуска наступила полночь, а пропущенные запуски догоняются следующим
+    """
+
+    return (
+        select(*columns)
+        .join(User, User.id == Habit.user_id)
+        .where(
+            Habit.alert_at <= func.now(),
+            Habit.completed_date.is_(None),
+            Habit.alert_date < sql_local_date(User.timezone),
+        )
+    )
+
+
+async def plan_shards(session: AsyncSession) -> list[tuple[int, int]]:
+    """
+    Разбиение пользователей с невыполненными целями на диапазоны идентификаторов по ROLLOVER_SHARD_SIZE
+    """
+
+    res = await session.execute(select_missed_habits(Habit.user_id).distinct().order_by(Habit.user_id))
+    user_ids = res.scalars().all()
+
+    return [
+        (user_ids[start], user_ids[min(start + ROLLOVER_SHARD_SIZE, len(user_ids)) - 1])
+        for start in range(0, len(user_ids), ROLLOVER_SHARD_SIZE)
+    ]
+
+
+def build_reset_stmt(first_user_id: int, last_user_id: int, checkpoint_id: int) -> Select:
+    """
+    Запрос сброса счётчика невыполненных за день целей пользователей из диапазона идентификаторов
 
-        stmt = select(Habit).where(Habit.alert_date == aware_date)
-        res = await session.execute(stmt)
-        unmarked_habits = res.scalars().all()
-        for habit in unmarked_habits:
-            habit.alert_date += timedelta(days=1)
-            habit.process = 0
+    В том же запросе пропуск записывается в историю выполнения с отметкой части checkpoint_id
+    и учитывается в статистике. Возвращает только поля, необходимые для уведомления пользователя
+    """
+
+    today = sql_local_date(User.timezone)
+    due = (
+        select_missed_habits(Habit.id, Habit.alert_date.label('missed_date'), today.label('today'), User.timezone)
+        .where(Habit.user_id.between(first_user_id, last_user_id))
+        .subquery('due')
+    )
+    reset = (
+        update(Habit)
+        .where(Habit.id == due.c.id, Habit.alert_date == due.c.missed_date)
+        .values(
+            alert_date=due.c.today,
+            alert_at=sql_localize(due.c.timezone, due.c.today, Habit.alert_time),
+            process=0,
+        )
+        .returning(Habit.id, Habit.user_id, Habit.title, due.c.missed_date)
+        .cte('reset')
+    )
+    checkins, stats = build_checkin_ctes(
+        habits=reset, checkin_date=reset.c.missed_date, outcome=HabitCheckin.MISSED, checkpoint_id=checkpoint_id
+    )
+
+    return select(reset).add_cte(checkins, stats)
+
+
+async def reset_missed_habits(
+    session: AsyncSession, first_user_id: int, last_user_id: int, checkpoint_id: int
+) -> Sequence[Row]:
+    """
+    Сброс счётчика невыполненных за день целей пользователей из диапазона идентификаторов одним запросом
+    """
+
+    res = await session.execute(
+        build_reset_stmt(first_user_id=first_user_id, last_user_id=last_user_id, checkpoint_id=checkpoint_id)
+    )
+
+    return res.all()
+
+
+async def notify_reset(habits: Sequence[Row], semaphore: asyncio.Semaphore) -> int:
+    """
+    Уведомление пользователей о сбросе счётчика с ограничением числа одновременных отправок
 
-            from app.bot import bot
+    Возвращает количество доставленных уведомлений
+    """
 
-            await bot.send_message(
+    async def notify(habit: Row) -> bool:
+        async with semaphore:
+            result = await send_message(
                 chat_id=habit.user_id,
                 text=f'❌ Не выполнена цель по привычке "{habit.title}". Счётчик сброшен. '
                 'В Следующий раз у Вас обязательно получится. ✊',
                 disable_notification=True,
             )
+            return result is not None
+
+    results = await asyncio.gather(*(notify(habit) for habit in habits))
+
+    return sum(results)
+
+
+async def finish_checkpoint(checkpoint_id: int, notified: int) -> None:
+    async with async_session() as session:
+        stmt = (
+            update(RolloverCheckpoint)
+            .where(RolloverCheckpoint.id == checkpoint_id)
+            .values(notified=notified, notified_at=func.now())
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def rollover_shard(first_user_id: int, last_user_id: int, semaphore: asyncio.Semaphore) -> ShardReport:
+    """
+    Перенос невыполненных целей пользователей из диапазона идентификаторов
+
+    Сброс целей и отметка о завершении части фиксируются одной короткой транзакцией, а уведомления
+    отправляются уже после её фиксации, чтобы не удерживать блокировки строк
+    """
+
+    started = time.perf_counter()
+    report = ShardReport(first_user_id=first_user_id, last_user_id=last_user_id)
+
+    async with async_session() as session:
+        res = await session.execute(
+            insert(RolloverCheckpoint)
+            .values(first_user_id=first_user_id, last_user_id=last_user_id, reset=0)
+            .returning(RolloverCheckpoint.id)
+        )
+        checkpoint_id = res.scalar_one()
+        missed_habits = await reset_missed_habits(
+            session=session, first_user_id=first_user_id, last_user_id=last_user_id, checkpoint_id=checkpoint_id
+        )
+        await bump_habits_version(session, *(habit.user_id for habit in missed_habits))
+        await session.execute(
+            update(RolloverCheckpoint).where(RolloverCheckpoint.id == checkpoint_id).values(reset=len(missed_habits))
+        )
+        await session.commit()
+    invalidate_agenda(*(habit.user_id for habit in missed_habits))
+    report.reset = len(missed_habits)
+
+    if missed_habits:
+        report.notified = await notify_reset(habits=missed_habits, semaphore=semaphore)
+        report.failed = report.reset - report.notified
+    await finish_checkpoint(checkpoint_id=checkpoint_id, notified=report.notified)
+
+    report.duration = time.perf_counter() - started
+    job_duration.labels('rollover_shard').observe(report.duration)
+
+    return report
+
+
+async def get_unnotified_habits(session: AsyncSession, checkpoint: RolloverCheckpoint) -> Sequence[Row]:
+    """
+    Цели, сброшенные в части, уведомления о которой не отправлены
+
+    Записи о пропусках созданы в одной транзакции с отметкой о завершении части и ссылаются на неё,
+    поэтому выбираются по индексу checkpoint_id
+    """
+
+    stmt = (
+        select(Habit.id, Habit.user_id, Habit.title)
+        .join(HabitCheckin, HabitCheckin.habit_id == Habit.id)
+        .where(HabitCheckin.checkpoint_id == checkpoint.id)
+    )
+    res = await session.execute(stmt)
+
+    return res.all()
+
+
+async def resume_notifications(now: datetime, semaphore: asyncio.Semaphore) -> int:
+    """
+    Отправка уведомлений частей, обработка которых прервалась после сброса целей (например, перезапуском)
+
+    Уведомления старше ROLLOVER_RESUME_WINDOW уже не актуальны и не отправляются.
+    Возвращает количество доставленных уведомлений
+    """
+
+    resumed = 0
+
+    async with async_session() as session:
+        res = await session.execute(
+            select(RolloverCheckpoint).where(
+                RolloverCheckpoint.notified_at.is_(None), RolloverCheckpoint.reset_at > now - ROLLOVER_RESUME_WINDOW
+            )
+        )
+        checkpoints = res.scalars().all()
+        pending = [(checkpoint, await get_unnotified_habits(session, checkpoint)) for checkpoint in checkpoints]
+
+    for checkpoint, habits in pending:
+        notified = await notify_reset(habits=habits, semaphore=semaphore)
+        await finish_checkpoint(checkpoint_id=checkpoint.id, notified=notified)
+        resumed += notified
+
+    return resumed
+
 
-            update_job_datetime(habit=habit)
+async def prune_checkpoints(now: datetime) -> None:
+    async with async_session() as session:
+        await session.execute(
+            delete(RolloverCheckpoint).where(RolloverCheckpoint.reset_at < now - ROLLOVER_CHECKPOINT_TTL)
+        )
         await session.commit()
+
+
+@timed(job_duration, 'summarize_daily_results')
+async def summarize_daily_results() -> RolloverReport:
+    """
+    Перенос невыполненных дневных целей (выполняется планировщиком каждые 15 минут)
+
+    Цели пользователей из разных часовых поясов переносятся по мере наступления полуночи в каждом из них,
+    поэтому нагрузка распределяется по суткам. Пользователи делятся на диапазоны идентификаторов, которые
+    обрабатываются одновременно (не более ROLLOVER_CONCURRENCY) и фиксируются независимо. Перезапуск теряет
+    только незафиксированные части: их цели выбираются следующим запуском, а недоставленные уведомления
+    зафиксированных частей досылаются по отметкам о завершении
+    """
+
+    started = time.perf_counter()
+    now = aware_now()
+    report = RolloverReport()
+    # Ограничение нужно, чтобы массовая рассылка не вытесняла из общей очереди ответы другим пользователям
+    notify_semaphore = asyncio.Semaphore(ROLLOVER_NOTIFY_CONCURRENCY)
+    shard_semaphore = asyncio.Semaphore(ROLLOVER_CONCURRENCY)
+
+    report.resumed = await resume_notifications(now=now, semaphore=notify_semaphore)
+
+    async with async_session() as session:
+        shards = await plan_shards(session=session)
+
+    async def run_shard(first_user_id: int, last_user_id: int) -> ShardReport:
+        async with shard_semaphore:
+            return await rollover_shard(
+                first_user_id=first_user_id, last_user_id=last_user_id, semaphore=notify_semaphore
+            )
+
+    results = await asyncio.gather(*(run_shard(*shard) for shard in shards), return_exceptions=True)
+    for shard, result in zip(shards, results):
+        if isinstance(result, BaseException):
+            logger.error('Rollover shard %s-%s failed', *shard, exc_info=result)
+            continue
+        report.shards.append(result)
+        report.reset += result.reset
+        report.notified += result.notified
+        report.failed += result.failed
+        logger.info(
+            'Rollover shard %s-%s: reset=%s notified=%s failed=%s duration=%.3fs',
+            result.first_user_id,
+            result.last_user_id,
+            result.reset,
+            result.notified,
+            result.failed,
+            result.duration,
+        )
+
+    if shards:
+        await prune_checkpoints(now=now)
+
+    report.duration = time.perf_counter() - started
+    if shards or report.resumed:
+        logger.info(
+            'Daily rollover: shards=%s reset=%s notified=%s failed=%s resumed=%s duration=%.3fs',
+            len(shards),
+            report.reset,
+            report.notified,
+            report.failed,
+            report.resumed,
+            report.duration,
+        )
+
+    return report
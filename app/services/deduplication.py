@@ -0,0 +1,119 @@
+from collections import deque
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.utils import aware_now
+from app.database import async_session
+from app.models import ProcessedUpdate
+from app.settings import WEBHOOK_DEDUP_BACKEND, WEBHOOK_DEDUP_TTL, WEBHOOK_DEDUP_WINDOW
+
+
+class RecentUpdates:
+    """
+    Окно последних полученных идентификаторов обновлений (update_id)
+
+    Кольцевой буфер хранит порядок поступления, множество - быструю проверку наличия.
+    Самые старые идентификаторы вытесняются при заполнении окна
+    """
+
+    def __init__(self, size: int = WEBHOOK_DEDUP_WINDOW) -> None:
+        self._order: deque[int] = deque(maxlen=size)
+        self._ids: set[int] = set()
+
+        self.dropped = 0
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, update_id: int) -> bool:
+        """
+        Запоминание идентификатора обновления
+
+        Возвращает False, если обновление уже было получено (повторная доставка)
+        """
+
+        if update_id in self._ids:
+            self.dropped += 1
+            return False
+
+        if len(self._order) == self._order.maxlen:
+            self._ids.discard(self._order[0])
+        self._order.append(update_id)
+        self._ids.add(update_id)
+
+        return True
+
+    def discard(self, update_id: int) -> None:
+        """
+        Удаление идентификатора обновления из окна, чтобы повторная доставка была обработана
+        """
+
+        if update_id in self._ids:
+            self._ids.discard(update_id)
+            self._order.remove(update_id)
+
+    def stats(self) -> dict:
+        return {'window': len(self), 'dropped': self.dropped}
+
+
+recent_updates = RecentUpdates()
+
+
+async def register_update(session: AsyncSession, update_id: int) -> bool:
+    """
+    Регистрация полученного обновления
+
+    Возвращает False для повторно доставленных обновлений, которые не нужно обрабатывать.
+    В режиме postgres обновление дополнительно регистрируется в базе данных, чтобы повторная доставка
+    отсеивалась и в том случае, когда она попала в другой процесс приложения
+    """
+
+    if not recent_updates.add(update_id):
+        return False
+
+    if WEBHOOK_DEDUP_BACKEND == 'postgres':
+        stmt = (
+            insert(ProcessedUpdate)
+            .values(update_id=update_id)
+            .on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+            .returning(ProcessedUpdate.update_id)
+        )
+        res = await session.execute(stmt)
+        await session.commit()
+        if res.scalar_one_or_none() is None:
+            recent_updates.dropped += 1
+            return False
+
+    return True
+
+
+async def forget_update(update_id: int) -> None:
+    """
+    Отмена регистрации обновления, которое не удалось поставить в очередь или обработать
+
+    Telegram доставит такое обновление повторно, и оно не должно быть отброшено как уже полученное.
+    Используется отдельная сессия, так как сессия запроса может быть в состоянии ошибки
+    """
+
+    recent_updates.discard(update_id)
+
+    if WEBHOOK_DEDUP_BACKEND == 'postgres':
+        async with async_session() as session:
+            await session.execute(delete(ProcessedUpdate).where(ProcessedUpdate.update_id == update_id))
+            await session.commit()
+
+
+async def prune_processed_updates() -> None:
+    """
+    Удаление из базы данных идентификаторов обновлений, повторная доставка которых уже невозможна
+    """
+
+    async with async_session() as session:
+        stmt = delete(ProcessedUpdate).where(ProcessedUpdate.received_at < aware_now() - WEBHOOK_DEDUP_TTL)
+        await session.execute(stmt)
+        await session.commit()
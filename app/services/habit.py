@@ -1,43 +1,173 @@
-from datetime import timedelta
-from typing import Sequence, Union
+from dataclasses import dataclass, field
+from datetime import date, time, timedelta
+from typing import Any, AsyncIterator, Iterable, Sequence, Union
 
+from pydantic import ValidationError
 from sqlalchemy import (
+    ARRAY,
+    Integer,
+    Row,
+    Select,
+    any_,
+    bindparam,
+    case,
+    insert,
     select,
+    tuple_,
+    update,
 )
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.utils import aware_now
-from app.models import Habit
-from app.services.notification import (
-    add_job_by_datetime,
-    delete_job,
-    update_job_datetime,
+from app.core.cache import TTLCache
+from app.core.metrics import habit_service_duration, timed
+from app.core.utils import aware_now, localize, sql_localize
+from app.database import async_session
+from app.models import Habit, HabitCheckin, User
+from app.schemas import HabitImportRow
+from app.services.checkin import build_checkin_ctes
+from app.services.sender import send_message
+from app.services.user import get_user_timezone
+from app.settings import (
+    AGENDA_CACHE_SIZE,
+    AGENDA_CACHE_TTL,
+    HABITS_EXPORT_CHUNK_SIZE,
+    HABITS_IMPORT_CHUNK_SIZE,
+    HABITS_IMPORT_MAX_ERRORS,
+    HABITS_IMPORT_MAX_ROWS,
+    HABITS_PAGE_SIZE,
 )
 
+# Поля целей при выгрузке и загрузке
+HABIT_EXPORT_FIELDS = ('title', 'description', 'target', 'process', 'alert_time', 'completed_date')
 
+# Ключ постраничного вывода выполненных целей: (дата выполнения, идентификатор)
+HabitKey = tuple[date, int]
+
+
+@dataclass
+class HabitsPage:
+    """
+    Страница списка выполненных целей
+    """
+
+    habits: Sequence[Habit]
+    has_prev: bool
+    has_next: bool
+
+    @property
+    def first_key(self) -> Union[HabitKey, None]:
+        return (self.habits[0].completed_date, self.habits[0].id) if self.habits else None
+
+    @property
+    def last_key(self) -> Union[HabitKey, None]:
+        return (self.habits[-1].completed_date, self.habits[-1].id) if self.habits else None
+
+
+@dataclass(frozen=True)
+class AgendaHabit:
+    """
+    Снимок цели на сегодня для списка отметки выполнения, не привязанный к сессии базы данных
+    """
+
+    id: int
+    title: str
+
+
+@dataclass(frozen=True)
+class Agenda:
+    """
+    Цели пользователя на местную дату вместе с часовым поясом, по которому эта дата вычислена
+    """
+
+    timezone: str
+    day: date
+    habits: tuple[AgendaHabit, ...]
+
+
+# Цели пользователей на сегодня по идентификатору пользователя
+agenda_cache = TTLCache(maxsize=AGENDA_CACHE_SIZE, ttl=AGENDA_CACHE_TTL)
+
+
+def invalidate_agenda(*user_ids: int) -> None:
+    """
+    Удаление целей на сегодня пользователей из кэша (после фиксации изменения целей или часового пояса)
+    """
+
+    for user_id in user_ids:
+        agenda_cache.pop(user_id)
+
+
+def format_habit_key(key: HabitKey) -> str:
+    return f'{key[0].isoformat()}.{key[1]}'
+
+
+def parse_habit_key(value: str) -> HabitKey:
+    """
+    Разбор ключа страницы, полученного от клиента (ValueError при неверном формате)
+    """
+
+    completed_date, habit_id = value.split('.')
+    return date.fromisoformat(completed_date), int(habit_id)
+
+
+async def bump_habits_version(session: AsyncSession, *user_ids: int) -> None:
+    """
+    Увеличение номера версии списка целей пользователей (в текущей транзакции)
+
+    Номер версии используется для кэширования страниц webapp, поэтому должен увеличиваться
+    при любом изменении целей пользователя
+    """
+
+    if user_ids:
+        stmt = (
+            update(User)
+            .where(User.id == any_(bindparam('user_ids', sorted(set(user_ids)), type_=ARRAY(Integer))))
+            .values(habits_version=User.habits_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(stmt)
+
+
+async def get_habits_version(session: AsyncSession, user_id: int) -> Union[int, None]:
+    """
+    Получение номера версии списка целей пользователя
+    """
+
+    res = await session.execute(select(User.habits_version).where(User.id == user_id))
+    return res.scalar_one_or_none()
+
+
+@timed(habit_service_duration, 'create_habit')
 async def create_habit(session: AsyncSession, user_id: int, habit_data: dict) -> Habit:
     """
     Добавление новой цели
     """
 
+    tz = await get_user_timezone(session=session, user_id=user_id)
+    now = aware_now(tz)
     habit = Habit(
         user_id=user_id,
         title=habit_data['title'],
         description=habit_data.get('description', ''),
         target=habit_data['target'],
         alert_time=habit_data['alert_time'],
-        alert_date=aware_now().date(),
+        alert_date=now.date(),
     )
+    habit.alert_at = localize(tz, habit.alert_date, habit.alert_time)
+    # Время напоминания на сегодня уже прошло, первое напоминание будет завтра
+    if habit.alert_time <= now.time():
+        habit.alerted_date = habit.alert_date
     session.add(habit)
+    await bump_habits_version(session, user_id)
     await session.commit()
+    invalidate_agenda(user_id)
 
     await session.refresh(habit)
 
-    add_job_by_datetime(habit=habit)
-
     return habit
 
 
+@timed(habit_service_duration, 'update_habit')
 async def update_habit(session: AsyncSession, habit: Habit, data: dict) -> Habit:
     """
     Обновление новой цели
@@ -45,106 +175,326 @@ async def update_habit(session: AsyncSession, habit: Habit, data: dict) -> Habit
 
     alert_time_old = habit.alert_time
 
-    for field in ['title', 'description', 'target', 'alert_time']:
-        setattr(habit, field, data.get(field, ''))
+    for name in ['title', 'description', 'target', 'alert_time']:
+        setattr(habit, name, data.get(name, ''))
 
-    if alert_time_old != habit.alert_time:
-        now = aware_now()
+    if alert_time_old != habit.alert_time and habit.alert_date:
+        tz = await get_user_timezone(session=session, user_id=habit.user_id)
+        habit.alert_at = localize(tz, habit.alert_date, habit.alert_time)
+        now = aware_now(tz)
         if now.date() == habit.alert_date:
             if habit.alert_time < now.time() < alert_time_old:
-
-                from app.bot import bot
-
-                await bot.send_message(
+                # Напоминание на сегодня считается отправленным, иначе оно уйдёт сразу с опозданием
+                habit.alerted_date = habit.alert_date
+                send_message(
                     chat_id=habit.user_id,
                     text=f'❗ В связи с изменением времени уведомления для привычки "{habit.title}", '
                     f'напоминание, ранее назначенное на сегодня на {alert_time_old}, не будет отправлено.',
                 )
             elif habit.alert_time > now.time():
-                update_job_datetime(habit=habit)
+                habit.alerted_date = None
 
+    await bump_habits_version(session, habit.user_id)
     await session.commit()
+    invalidate_agenda(habit.user_id)
 
     return habit
 
 
+def select_habit(user_id: int, habit_id: int, active: bool = False) -> Select:
+    stmt = select(Habit).where(Habit.id == habit_id, Habit.user_id == user_id)
+    if active:
+        stmt = stmt.where(Habit.completed_date.is_(None))
+    return stmt
+
+
+@timed(habit_service_duration, 'get_habit')
 async def get_habit(session: AsyncSession, user_id: int, habit_id: int, active: bool = False) -> Union[Habit, None]:
     """
     Получение цели по идентификатору
     """
 
-    stmt = select(Habit).where(Habit.id == habit_id, Habit.user_id == user_id)
-    if active:
-        stmt = stmt.where(Habit.completed_date.is_(None))
-    res = await session.execute(stmt)
+    res = await session.execute(select_habit(user_id=user_id, habit_id=habit_id, active=active))
 
     return res.scalars().one_or_none()
 
 
+def select_active_habits(user_id: int) -> Select:
+    return select(Habit).where(Habit.user_id == user_id, Habit.completed_date.is_(None))
+
+
+@timed(habit_service_duration, 'get_active_habits')
 async def get_active_habits(session: AsyncSession, user_id: int) -> Sequence[Habit]:
     """
     Получение активных целей (целей в работе)
     """
 
-    stmt = select(Habit).where(Habit.user_id == user_id, Habit.completed_date.is_(None))
-    res = await session.execute(stmt)
+    res = await session.execute(select_active_habits(user_id=user_id))
 
     return res.scalars().all()
 
 
-async def get_completed_habits(session: AsyncSession, user_id: int) -> Sequence[Habit]:
+def select_completed_habits(
+    user_id: int,
+    after: Union[HabitKey, None] = None,
+    before: Union[HabitKey, None] = None,
+    page_size: int = HABITS_PAGE_SIZE,
+) -> Select:
+    """
+    Выборка страницы выполненных целей (на одну цель больше страницы, чтобы узнать о наличии следующей)
+    """
+
+    key = tuple_(Habit.completed_date, Habit.id)
+    stmt = select(Habit).where(Habit.user_id == user_id, Habit.completed_date.is_not(None)).limit(page_size + 1)
+    if before:
+        return stmt.where(key < tuple_(*before)).order_by(Habit.completed_date.desc(), Habit.id.desc())
+    stmt = stmt.order_by(Habit.completed_date, Habit.id)
+    if after:
+        stmt = stmt.where(key > tuple_(*after))
+    return stmt
+
+
+@timed(habit_service_duration, 'get_completed_habits')
+async def get_completed_habits(
+    session: AsyncSession,
+    user_id: int,
+    after: Union[HabitKey, None] = None,
+    before: Union[HabitKey, None] = None,
+    page_size: int = HABITS_PAGE_SIZE,
+) -> HabitsPage:
     """
-    Получение выполненных целей
+    Получение страницы выполненных целей в порядке (дата выполнения, идентификатор)
+
+    Страница выбирается по ключу последней цели предыдущей страницы (after) или первой цели
+    следующей страницы (before), поэтому запрос не зависит от общего количества выполненных целей
     """
 
-    stmt = select(Habit).where(Habit.user_id == user_id, Habit.completed_date.is_not(None))
+    stmt = select_completed_habits(user_id=user_id, after=after, before=before, page_size=page_size)
     res = await session.execute(stmt)
+    habits = res.scalars().all()
 
-    return res.scalars().all()
+    has_more = len(habits) > page_size
+    habits = habits[:page_size]
+    if before:
+        return HabitsPage(habits=habits[::-1], has_prev=has_more, has_next=True)
+    return HabitsPage(habits=habits, has_prev=after is not None, has_next=has_more)
 
 
-async def get_actual_habits(session: AsyncSession, user_id: int) -> Sequence[Habit]:
+def select_agenda(user_id: int, day: date) -> Select:
+    return (
+        select(Habit.id, Habit.title)
+        .where(Habit.user_id == user_id, Habit.alert_date == day)
+        .order_by(Habit.alert_time, Habit.id)
+    )
+
+
+@timed(habit_service_duration, 'get_actual_habits')
+async def get_actual_habits(session: AsyncSession, user_id: int) -> Sequence[AgendaHabit]:
     """
-    Получение активных целей на сегодняшний день
+    Получение активных целей на сегодняшний день с использованием кэша
+
+    Запись кэша хранит часовой пояс пользователя, поэтому повторный запрос в пределах AGENDA_CACHE_TTL
+    не обращается к базе данных. Кэш сбрасывается функциями, изменяющими цели и часовой пояс, а его записи
+    живут не дольше местной полуночи, поэтому список не переносится на следующий день
     """
 
-    aware_date = aware_now().date()
+    if (agenda := agenda_cache.get(user_id)) is not None and agenda.day == aware_now(agenda.timezone).date():
+        return agenda.habits
 
-    stmt = select(Habit).where(Habit.user_id == user_id, Habit.alert_date == aware_date)
-    res = await session.execute(stmt)
+    tz = await get_user_timezone(session=session, user_id=user_id)
+    now = aware_now(tz)
+    res = await session.execute(select_agenda(user_id=user_id, day=now.date()))
+    habits = tuple(AgendaHabit(id=row.id, title=row.title) for row in res)
 
-    return res.scalars().all()
+    until_midnight = (localize(tz, now.date() + timedelta(days=1), time()) - now).total_seconds()
+    agenda_cache.set(
+        user_id, Agenda(timezone=tz, day=now.date(), habits=habits), ttl=min(AGENDA_CACHE_TTL, until_midnight)
+    )
+
+    return habits
 
 
+@timed(habit_service_duration, 'delete_habit')
 async def delete_habit(session: AsyncSession, habit: Habit) -> None:
     """
     Удаление цели
     """
 
-    delete_job(habit=habit)
-
     await session.delete(habit)
+    await bump_habits_version(session, habit.user_id)
     await session.commit()
+    invalidate_agenda(habit.user_id)
 
 
-async def mark_habit(session: AsyncSession, habit_id: int, user_id: int) -> Union[Habit, None]:
+def build_mark_stmt(habit_id: int, user_id: int, tz: str, day: date) -> Select:
     """
-    Отметка о выполнении дневной цели
+    Запрос отметки о выполнении цели за день day (в часовом поясе пользователя tz)
+    """
+
+    completed = Habit.process + 1 >= Habit.target
+    next_day = day + timedelta(days=1)
+
+    marked = (
+        update(Habit)
+        .where(
+            Habit.id == habit_id,
+            Habit.user_id == user_id,
+            Habit.alert_date == day,
+            Habit.completed_date.is_(None),
+        )
+        .values(
+            process=Habit.process + 1,
+            completed_date=case((completed, day), else_=None),
+            alert_date=case((completed, None), else_=next_day),
+            alert_at=case((completed, None), else_=sql_localize(tz, next_day, Habit.alert_time)),
+        )
+        .returning(Habit.id, Habit.user_id, Habit.title, Habit.process, Habit.target, Habit.completed_date)
+        .cte('marked')
+    )
+    bumped = (
+        update(User)
+        .where(User.id.in_(select(marked.c.user_id)))
+        .values(habits_version=User.habits_version + 1)
+        .cte('bumped')
+    )
+    checkins, stats = build_checkin_ctes(habits=marked, checkin_date=day, outcome=HabitCheckin.DONE)
+    return (
+        select(marked, stats.c.current_streak, stats.c.best_streak)
+        .outerjoin(stats, stats.c.habit_id == marked.c.id)
+        .add_cte(bumped, checkins)
+    )
+
+
+@timed(habit_service_duration, 'mark_habit')
+async def mark_habit(session: AsyncSession, habit_id: int, user_id: int) -> Union[Row, None]:
     """
+    Отметка о выполнении дневной цели
 
-    aware_date = aware_now().date()
+    Счётчик увеличивается, а выполнение цели определяется одним запросом на стороне базы данных,
+    поэтому повторные нажатия кнопки не теряют отметок и не отмечают цель дважды за день.
+    Номер версии списка целей пользователя, история и статистика выполнения обновляются в том же запросе.
+    Возвращает только поля, необходимые для ответа пользователю, вместе с текущей и лучшей сериями выполнения
+    (None, если цель на сегодня уже отмечена)
+    """
 
-    stmt = select(Habit).where(Habit.id == habit_id, Habit.user_id == user_id, Habit.alert_date == aware_date)
+    tz = await get_user_timezone(session=session, user_id=user_id)
+    stmt = build_mark_stmt(habit_id=habit_id, user_id=user_id, tz=tz, day=aware_now(tz).date())
     res = await session.execute(stmt)
-    if habit := res.scalars().one_or_none():
-        habit.process += 1
-        if habit.process == habit.target:
-            habit.completed_date = aware_date
-            habit.alert_date = None
-            delete_job(habit=habit)
-        else:
-            habit.alert_date = aware_date + timedelta(days=1)
-            update_job_datetime(habit=habit)
+    habit = res.one_or_none()
+    await session.commit()
+    invalidate_agenda(user_id)
+
+    return habit
+
+
+async def stream_habits(user_id: int) -> AsyncIterator[Sequence[Row]]:
+    """
+    Выгрузка всех целей пользователя частями по HABITS_EXPORT_CHUNK_SIZE строк
+
+    Строки читаются через серверный курсор, поэтому в памяти находится только одна часть.
+    Выгрузка открывает собственную сессию, так как продолжается после выхода из обработчика запроса
+    """
+
+    stmt = (
+        select(*(getattr(Habit, name) for name in HABIT_EXPORT_FIELDS))
+        .where(Habit.user_id == user_id)
+        .order_by(Habit.id)
+        .execution_options(yield_per=HABITS_EXPORT_CHUNK_SIZE)
+    )
+    async with async_session() as session:
+        res = await session.stream(stmt)
+        async for rows in res.partitions():
+            yield rows
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return '; '.join(
+        f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err['loc'] else err['msg'] for err in error.errors()
+    )
+
+
+@dataclass
+class ImportReport:
+    """
+    Результат загрузки целей
+    """
+
+    imported: int = 0
+    rejected: int = 0
+    errors: list[dict] = field(default_factory=list)
+
+
+def validate_import_rows(rows: Iterable[Any]) -> tuple[list[HabitImportRow], ImportReport]:
+    """
+    Проверка загружаемых строк схемой HabitImportRow
+
+    Функция синхронная (чтение файла и проверка строк), поэтому вызывается в пуле потоков.
+    Возвращает корректные строки и отчёт с номерами и причинами отклонения остальных
+    """
+
+    report = ImportReport()
+    habits = []
+
+    for number, row in enumerate(rows, start=1):
+        if number > HABITS_IMPORT_MAX_ROWS:
+            report.errors.append({'row': number, 'error': f'Загружено максимальное количество строк ({number - 1})'})
+            break
+        try:
+            habits.append(HabitImportRow.model_validate(row))
+        except ValidationError as e:
+            report.rejected += 1
+            if len(report.errors) < HABITS_IMPORT_MAX_ERRORS:
+                report.errors.append({'row': number, 'error': format_validation_error(e)})
+
+    return habits, report
+
+
+@timed(habit_service_duration, 'import_habits')
+async def import_habits(
+    session: AsyncSession, user_id: int, habits: Sequence[HabitImportRow], report: ImportReport
+) -> ImportReport:
+    """
+    Загрузка целей пользователя, проверенных validate_import_rows
+
+    Цели добавляются одним запросом на HABITS_IMPORT_CHUNK_SIZE строк в общей транзакции. Состояние напоминаний
+    задаётся сразу при добавлении так же, как при создании цели, поэтому отдельного планирования напоминаний
+    не требуется
+    """
+
+    tz = await get_user_timezone(session=session, user_id=user_id)
+    now = aware_now(tz)
+    chunk = []
+
+    async def flush() -> None:
+        if chunk:
+            await session.execute(insert(Habit), chunk)
+            report.imported += len(chunk)
+            chunk.clear()
+
+    for habit in habits:
+        active = habit.completed_date is None
+        chunk.append(
+            {
+                'user_id': user_id,
+                'title': habit.title,
+                'description': habit.description or '',
+                'target': habit.target,
+                'process': habit.process,
+                'alert_time': habit.alert_time,
+                'alert_date': now.date() if active else None,
+                'alert_at': localize(tz, now.date(), habit.alert_time) if active else None,
+                'completed_date': habit.completed_date,
+                # Время напоминания на сегодня уже прошло, первое напоминание будет завтра
+                'alerted_date': now.date() if active and habit.alert_time <= now.time() else None,
+            }
+        )
+        if len(chunk) >= HABITS_IMPORT_CHUNK_SIZE:
+            await flush()
+    await flush()
+
+    if report.imported:
+        await bump_habits_version(session, user_id)
         await session.commit()
+        invalidate_agenda(user_id)
 
-        return habit
+    return report
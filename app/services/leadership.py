@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Callable, Union
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.core.utils import aware_now
+from app.database import engine
+from app.settings import INSTANCE_NAME, LEADER_CHECK_INTERVAL, LEADER_LOCK_KEY
+
+logger = logging.getLogger(__name__)
+
+instance_name = INSTANCE_NAME or f'{socket.gethostname()}:{os.getpid()}'
+
+
+class LeaderElection:
+    """
+    Выбор ведущего процесса приложения по advisory-блокировке PostgreSQL
+
+    Ведущим становится процесс, захвативший блокировку pg_try_advisory_lock. Блокировка принадлежит
+    соединению с базой данных, поэтому освобождается сервером, как только ведущий процесс завершается
+    или теряет соединение, после чего её захватывает один из остальных процессов при очередной проверке
+    """
+
+    def __init__(self, lock_key: int = LEADER_LOCK_KEY, interval: float = LEADER_CHECK_INTERVAL) -> None:
+        self.lock_key = lock_key
+        self.interval = interval
+
+        self._conn: Union[AsyncConnection, None] = None
+        self._task: Union[asyncio.Task, None] = None
+        self._on_elected: Union[Callable[[], None], None] = None
+        self._on_demoted: Union[Callable[[], None], None] = None
+
+        self.leader_since: Union[datetime, None] = None
+        self.elections = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return self._conn is not None
+
+    async def _acquire(self) -> None:
+        conn = await engine.connect()
+        try:
+            await conn.execution_options(isolation_level='AUTOCOMMIT')
+            res = await conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.lock_key})
+            acquired = res.scalar()
+        except BaseException:
+            await conn.close()
+            raise
+        if not acquired:
+            await conn.close()
+            return
+
+        self._conn = conn
+        # Имя процесса видно остальным процессам в pg_stat_activity, а keepalive позволяет серверу
+        # быстрее освободить блокировку, если узел ведущего процесса перестал отвечать
+        await conn.execute(
+            text(
+                "SELECT set_config('application_name', :name, false), "
+                "set_config('tcp_keepalives_idle', :interval, false), "
+                "set_config('tcp_keepalives_interval', :interval, false), "
+                "set_config('tcp_keepalives_count', '3', false)"
+            ),
+            {'name': instance_name[:63], 'interval': str(int(self.interval))},
+        )
+        self.leader_since = aware_now()
+        self.elections += 1
+        logger.info('Instance %s became the leader', instance_name)
+        if self._on_elected:
+            self._on_elected()
+
+    async def _release(self) -> None:
+        if self._conn is None:
+            return
+
+        conn, self._conn = self._conn, None
+        self.leader_since = None
+        logger.info('Instance %s is no longer the leader', instance_name)
+        if self._on_demoted:
+            self._on_demoted()
+        # Соединение с блокировкой не возвращается в пул, его закрытие освобождает блокировку
+        try:
+            await conn.invalidate()
+        except (SQLAlchemyError, OSError):
+            logger.warning('Failed to close leader connection', exc_info=True)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._conn is None:
+                    await self._acquire()
+                else:
+                    await self._conn.execute(text('SELECT 1'))
+            except (SQLAlchemyError, OSError):
+                logger.warning('Leader election check failed', exc_info=True)
+                await self._release()
+            await asyncio.sleep(self.interval)
+
+    async def start(self, on_elected: Callable[[], None], on_demoted: Callable[[], None]) -> None:
+        """
+        Запуск периодических попыток стать ведущим процессом
+
+        on_elected и on_demoted вызываются при получении и потере статуса ведущего процесса
+        """
+
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Остановка выбора с освобождением блокировки, чтобы её сразу мог захватить другой процесс
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._release()
+
+    def stats(self) -> dict:
+        return {'is_leader': self.is_leader, 'elections': self.elections}
+
+
+leader = LeaderElection()
+
+
+async def get_current_leader(session: AsyncSession) -> Union[str, None]:
+    """
+    Имя ведущего процесса приложения (по любому из процессов)
+    """
+
+    res = await session.execute(
+        text(
+            'SELECT a.application_name FROM pg_locks AS l JOIN pg_stat_activity AS a ON a.pid = l.pid '
+            "WHERE l.locktype = 'advisory' AND l.granted AND l.classid = :classid AND l.objid = :objid "
+            'AND l.objsubid = 1'
+        ),
+        {'classid': LEADER_LOCK_KEY >> 32, 'objid': LEADER_LOCK_KEY & 0xFFFFFFFF},
+    )
+    return res.scalar_one_or_none()
@@ -1,92 +1,229 @@
-import datetime
-
-import pytz
-from apscheduler.jobstores.base import JobLookupError
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from time import perf_counter
+from typing import Sequence
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, JobExecutionEvent
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
+from sqlalchemy import (
+    Date,
+    Integer,
+    Row,
+    Update,
+    cast,
+    column,
+    or_,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from telebot import types
 
+from app.core.metrics import alert_lateness, job_duration, job_errors, timed
+from app.core.utils import aware_now
+from app.database import async_session
 from app.models import Habit
-from app.settings import APSCHEDULER_CONFIG, TZ
+from app.services.sender import send_message
+from app.settings import (
+    ALERT_BATCH_INTERVAL,
+    ALERT_BATCH_SIZE,
+    ALERT_CATCH_UP,
+    ALERT_DIGEST_SIZE,
+    ALERT_TITLE_LENGTH,
+    APSCHEDULER_CONFIG,
+)
+
+logger = logging.getLogger(__name__)
 
 scheduler = AsyncIOScheduler(gconfig=APSCHEDULER_CONFIG)
 
 
-async def alert(chat_id, habit_title, habit_id) -> None:
+def count_job_errors(event: JobExecutionEvent) -> None:
+    job_errors.labels(event.job_id, 'error' if event.code == EVENT_JOB_ERROR else 'missed').inc()
+
+
+scheduler.add_listener(count_job_errors, EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+
+@dataclass
+class DispatchReport:
     """
-    Оповещение пользователя о его дневной цели
+    Отчёт о рассылке напоминаний за одну минуту
+    """
+
+    due: int = 0
+    messages: int = 0
+    sent: int = 0
+    failed: int = 0
+    max_lateness: float = 0.0
+    duration: float = 0.0
+
+
+async def alert(chat_id: int, habits: Sequence[Row]) -> bool:
+    """
+    Оповещение пользователя о его дневных целях одним сообщением с кнопкой для каждой цели
     """
 
     markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton(text=habit_title, callback_data=f'habit#{habit_id}'))
-    from app.bot import bot
-
-    await bot.send_message(
-        chat_id=chat_id,
-        text=f'⚠ Напоминаем о необходимости закрепить привычку "{habit_title}". '
-        'Чтобы отметить выполнение нажмите на кнопку ниже. У Вас всё получиться. 😉',
-        reply_markup=markup,
-    )
+    for habit in habits:
+        markup.row(types.InlineKeyboardButton(text=habit.title, callback_data=f'habit#{habit.id}'))
+
+    if len(habits) == 1:
+        text = (
+            f'⚠ Напоминаем о необходимости закрепить привычку "{habits[0].title}". '
+            'Чтобы отметить выполнение нажмите на кнопку ниже. У Вас всё получиться. 😉'
+        )
+    else:
+        titles = '\n'.join(f'• {habit.title[:ALERT_TITLE_LENGTH]}' for habit in habits)
+        text = (
+            f'⚠ Напоминаем о необходимости закрепить привычки:\n{titles}\n'
+            'Чтобы отметить выполнение нажмите на кнопки ниже. У Вас всё получиться. 😉'
+        )
+    result = await send_message(chat_id=chat_id, text=text, reply_markup=markup)
+
+    return result is not None
 
 
-def get_job_id(user_id: int, habit_id: int):
+def group_alerts(habits: Sequence[Row]) -> list[Sequence[Row]]:
     """
-    Формирование идентификатора для задачи оповещения пользователя
+    Объединение напоминаний одному пользователю в сообщения не более чем по ALERT_DIGEST_SIZE целей
     """
 
-    return f'{user_id}#{habit_id}'
+    by_user: dict[int, list[Row]] = {}
+    for habit in habits:
+        by_user.setdefault(habit.user_id, []).append(habit)
 
+    digests = []
+    for user_habits in by_user.values():
+        for start in range(0, len(user_habits), ALERT_DIGEST_SIZE):
+            end = start + ALERT_DIGEST_SIZE
+            digests.append(user_habits[start:end])
 
-def get_job_trigger_by_habit(habit: Habit) -> DateTrigger:
+    return digests
+
+
+def build_claim_stmt(now: datetime) -> Update:
     """
-    Формирование триггера для задачи оповещения пользователя
+    Запрос выбора целей, по которым наступило время напоминания, с отметкой об отправке напоминания
+
+    Возвращает и прежнее значение отметки, чтобы её можно было вернуть, если напоминание не доставлено
     """
 
-    return DateTrigger(
-        run_date=datetime.datetime(
-            year=habit.alert_date.year,
-            month=habit.alert_date.month,
-            day=habit.alert_date.day,
-            hour=habit.alert_time.hour,
-            minute=habit.alert_time.minute,
-        ),
-        timezone=pytz.timezone(TZ),
+    claimed = (
+        select(Habit.id, Habit.alerted_date.label('previous_alerted_date'))
+        .where(
+            Habit.alert_at <= now,
+            Habit.alert_at > now - ALERT_CATCH_UP,
+            Habit.completed_date.is_(None),
+            or_(Habit.alerted_date.is_(None), Habit.alerted_date < Habit.alert_date),
+        )
+        .with_for_update(skip_locked=True)
+        .subquery('claimed')
+    )
+    return (
+        update(Habit)
+        .where(Habit.id == claimed.c.id)
+        .values(alerted_date=Habit.alert_date)
+        .returning(Habit.id, Habit.user_id, Habit.title, Habit.alert_at, claimed.c.previous_alerted_date)
+        .execution_options(synchronize_session=False)
     )
 
 
-def add_job_by_datetime(habit: Habit) -> None:
+async def claim_due_alerts(session: AsyncSession, now: datetime) -> Sequence[Row]:
     """
-    Добавление задачи планировщику по дневной цели пользователя
+    Выбор целей, по которым наступило время напоминания, с отметкой об отправке напоминания
+
+    Цели выбираются по моменту напоминания в UTC (alert_at), поэтому один запрос обслуживает пользователей
+    всех часовых поясов. Отметка (alerted_date) ставится тем же запросом, поэтому каждое напоминание достаётся
+    ровно одному процессу приложения. Напоминания, пропущенные не более чем на ALERT_CATCH_UP
+    (например, при перезапуске), отправляются с опозданием
     """
 
-    scheduler.add_job(
-        func=alert,
-        trigger=get_job_trigger_by_habit(habit=habit),
-        kwargs={'chat_id': habit.user_id, 'habit_title': habit.title, 'habit_id': habit.id},
-        id=get_job_id(user_id=habit.user_id, habit_id=habit.id),
-    )
+    res = await session.execute(build_claim_stmt(now=now))
+
+    return res.all()
 
 
-def update_job_datetime(habit: Habit) -> None:
+async def release_alerts(session: AsyncSession, habits: Sequence[Row]) -> None:
     """
-    Обновление задачи планировщика по дневной цели пользователя
+    Возврат прежней отметки об отправке напоминаний, которые не удалось доставить
+
+    Такие напоминания снова выбираются следующими запусками рассылки, пока не истечёт ALERT_CATCH_UP.
+    Отметка не возвращается, если цель за это время изменилась (отмечена, перенесена на следующий день)
     """
 
-    try:
-        scheduler.reschedule_job(
-            job_id=get_job_id(user_id=habit.user_id, habit_id=habit.id),
-            trigger=get_job_trigger_by_habit(habit=habit),
-        )
-    except JobLookupError:
-        pass
+    failed = values(column('id', Integer), column('previous_alerted_date', Date), name='failed').data(
+        [(habit.id, habit.previous_alerted_date) for habit in habits]
+    )
+    stmt = (
+        update(Habit)
+        .where(Habit.id == failed.c.id, Habit.alerted_date == Habit.alert_date)
+        .values(alerted_date=cast(failed.c.previous_alerted_date, Date))
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
 
 
-def delete_job(habit: Habit) -> None:
+@timed(job_duration, 'dispatch_alerts')
+async def dispatch_alerts() -> DispatchReport:
     """
-    Удаление задачи планировщика по дневной цели пользователя
+    Рассылка напоминаний, время которых наступило (выполняется планировщиком раз в минуту)
+
+    Напоминания отправляются пачками по ALERT_BATCH_SIZE сообщений с паузой ALERT_BATCH_INTERVAL секунд,
+    чтобы массовая рассылка не вытесняла из общей очереди ответы другим пользователям. Отметка об отправке
+    недоставленных напоминаний возвращается после рассылки, чтобы их повторила следующая рассылка
     """
 
-    try:
-        scheduler.remove_job(job_id=get_job_id(user_id=habit.user_id, habit_id=habit.id))
-    except JobLookupError:
-        pass
+    started = perf_counter()
+    now = aware_now()
+    report = DispatchReport()
+
+    async with async_session() as session:
+        due_habits = await claim_due_alerts(session=session, now=now)
+        await session.commit()
+    report.due = len(due_habits)
+
+    # Напоминания одному пользователю, время которых наступило одновременно, отправляются одним сообщением
+    digests = group_alerts(due_habits)
+    report.messages = len(digests)
+    undelivered = []
+
+    for start in range(0, len(digests), ALERT_BATCH_SIZE):
+        if start:
+            await asyncio.sleep(ALERT_BATCH_INTERVAL)
+        end = start + ALERT_BATCH_SIZE
+        batch = digests[start:end]
+        results = await asyncio.gather(*(alert(chat_id=habits[0].user_id, habits=habits) for habits in batch))
+        sent_at = aware_now()
+        for habits, sent in zip(batch, results):
+            if sent:
+                report.sent += len(habits)
+                for habit in habits:
+                    alert_lateness.labels().observe((sent_at - habit.alert_at).total_seconds())
+            else:
+                undelivered.extend(habits)
+
+    if undelivered:
+        async with async_session() as session:
+            await release_alerts(session=session, habits=undelivered)
+            await session.commit()
+
+    report.failed = report.due - report.sent
+    if due_habits:
+        report.max_lateness = (now - min(habit.alert_at for habit in due_habits)).total_seconds()
+    report.duration = perf_counter() - started
+    if report.due:
+        logger.info(
+            'Alerts dispatch: due=%s messages=%s sent=%s failed=%s max_lateness=%.0fs duration=%.3fs',
+            report.due,
+            report.messages,
+            report.sent,
+            report.failed,
+            report.max_lateness,
+            report.duration,
+        )
+
+    return report
@@ -0,0 +1,135 @@
+import logging
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import Time, and_, case, cast, func, or_, select, text, union, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.metrics import job_duration, timed
+from app.core.utils import sql_local_date, sql_localize
+from app.database import async_session
+from app.models import Habit, User
+
+logger = logging.getLogger(__name__)
+
+# Таблица хранилища задач apscheduler, в котором раньше хранилось по задаче напоминания на каждую цель
+LEGACY_JOBS_TABLE = 'apscheduler_jobs'
+
+
+@dataclass
+class ReconcileReport:
+    """
+    Отчёт о сверке состояния напоминаний с целями
+    """
+
+    active: int = 0
+    rescheduled: int = 0
+    cleared: int = 0
+    legacy_jobs: int = 0
+    duration: float = 0.0
+
+
+async def reconcile_habit_alerts(session: AsyncSession) -> ReconcileReport:
+    """
+    Исправление состояния напоминаний всех целей одним запросом
+
+    Напоминание активной цели назначено на вчера (до подведения итогов дня), сегодня или завтра
+    по часовому поясу пользователя, а момент напоминания в UTC задан. Активным целям с любой другой датой
+    напоминания (например, после восстановления из резервной копии) напоминание назначается на сегодня,
+    как при создании цели. У выполненных целей дата напоминания сбрасывается, чтобы они не попали
+    в рассылку и подведение итогов дня
+    """
+
+    today = sql_local_date(User.timezone)
+    local_time = cast(func.timezone(User.timezone, func.now()), Time)
+    active = Habit.completed_date.is_(None)
+
+    in_range = Habit.alert_date.between(today - 1, today + 1)
+    alert_date = case((in_range, Habit.alert_date), else_=today)
+    # Напоминания за прошедшие дни и за сегодня, время которых уже наступило, считаются отправленными
+    alerted = or_(alert_date < today, and_(alert_date == today, Habit.alert_time <= local_time))
+    rescheduled = (
+        update(Habit)
+        .where(
+            Habit.user_id == User.id,
+            active,
+            or_(
+                Habit.alert_date.is_(None),
+                ~in_range,
+                Habit.alerted_date > Habit.alert_date,
+                Habit.alert_at.is_(None),
+            ),
+        )
+        .values(
+            alert_date=alert_date,
+            alerted_date=case((alerted, alert_date), else_=None),
+            alert_at=sql_localize(User.timezone, alert_date, Habit.alert_time),
+        )
+        .returning(Habit.id, Habit.user_id)
+        .cte('rescheduled')
+    )
+    cleared = (
+        update(Habit)
+        .where(Habit.completed_date.is_not(None), or_(Habit.alert_date.is_not(None), Habit.alert_at.is_not(None)))
+        .values(alert_date=None, alert_at=None)
+        .returning(Habit.id, Habit.user_id)
+        .cte('cleared')
+    )
+    bumped = (
+        update(User)
+        .where(User.id.in_(union(select(rescheduled.c.user_id), select(cleared.c.user_id))))
+        .values(habits_version=User.habits_version + 1)
+        .cte('bumped')
+    )
+    stmt = select(
+        select(func.count()).select_from(Habit).where(active).scalar_subquery(),
+        select(func.count()).select_from(rescheduled).scalar_subquery(),
+        select(func.count()).select_from(cleared).scalar_subquery(),
+    ).add_cte(bumped)
+    res = await session.execute(stmt)
+
+    return ReconcileReport(*res.one())
+
+
+async def purge_legacy_jobs(session: AsyncSession) -> int:
+    """
+    Удаление задач напоминаний, оставшихся в таблице прежнего хранилища задач apscheduler
+
+    Возвращает количество удалённых задач (0, если таблицы нет)
+    """
+
+    res = await session.execute(select(func.to_regclass(LEGACY_JOBS_TABLE).is_not(None)))
+    if not res.scalar_one():
+        return 0
+
+    res = await session.execute(text(f'DELETE FROM {LEGACY_JOBS_TABLE}'))
+
+    return res.rowcount
+
+
+@timed(job_duration, 'reconcile_alerts')
+async def reconcile_alerts() -> ReconcileReport:
+    """
+    Сверка состояния напоминаний с целями (выполняется процессом, ставшим ведущим, и командой app.cli)
+
+    Расхождения находятся и исправляются запросами ко всем целям сразу, без обхода целей по одной
+    """
+
+    started = time.perf_counter()
+
+    async with async_session() as session:
+        report = await reconcile_habit_alerts(session=session)
+        report.legacy_jobs = await purge_legacy_jobs(session=session)
+        await session.commit()
+
+    report.duration = time.perf_counter() - started
+    logger.info(
+        'Alerts reconciliation: active=%s rescheduled=%s cleared=%s legacy_jobs=%s duration=%.3fs',
+        report.active,
+        report.rescheduled,
+        report.cleared,
+        report.legacy_jobs,
+        report.duration,
+    )
+
+    return report
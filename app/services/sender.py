@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Union
+
+from telebot.asyncio_helper import ApiException, ApiTelegramException, RequestTimeout
+
+from app.core.metrics import telegram_request_duration, telegram_request_errors
+from app.core.rate_limit import TokenBucket
+from app.settings import (
+    SEND_CHAT_BUCKETS_LIMIT,
+    SEND_CHAT_BURST,
+    SEND_CHAT_RATE,
+    SEND_FLOOD_CHATS,
+    SEND_FLOOD_WINDOW,
+    SEND_GLOBAL_RATE,
+    SEND_MAX_RETRIES,
+    SEND_STOP_TIMEOUT,
+    SEND_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OutgoingRequest:
+    """
+    Запрос к Telegram Bot API, ожидающий отправки
+    """
+
+    chat_id: Union[int, None]
+    method: str
+    kwargs: dict
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.perf_counter)
+    attempts: int = 0
+
+
+class SendQueue:
+    """
+    Общая очередь исходящих запросов к Telegram
+
+    Соблюдает глобальное ограничение Telegram на количество сообщений в секунду и ограничение
+    на один чат, повторяет запросы, отклонённые с кодом 429, после паузы retry_after.
+
+    Запросы к каждому чату копятся в своей очереди и отправляются по порядку, а обработчики получают
+    только чаты, у которых есть токен на отправку: чат с исчерпанным ограничением возвращается в работу
+    по таймеру, поэтому всплеск сообщений одному чату не задерживает сообщения остальным
+    """
+
+    def __init__(
+        self,
+        workers: int = SEND_WORKERS,
+        global_rate: float = SEND_GLOBAL_RATE,
+        chat_rate: float = SEND_CHAT_RATE,
+        chat_burst: float = SEND_CHAT_BURST,
+        max_retries: int = SEND_MAX_RETRIES,
+    ) -> None:
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        # Чаты, которые можно обслужить сейчас (каждый чат находится здесь или ждёт таймера не более одного раза)
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._chats: dict[int, deque[OutgoingRequest]] = {}
+        self._unfinished = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self._chat_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+        self._worker_tasks: list[asyncio.Task] = []
+        self._direct_tasks: set[asyncio.Task] = set()
+        # Время последнего ответа 429 по чатам для распознавания ограничения на весь бот
+        self._flood_chats: dict[Union[int, None], float] = {}
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.global_pauses = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._worker_tasks)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(requests) for requests in self._chats.values())
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate=self.chat_rate, capacity=self.chat_burst)
+            # Корзины давно молчащих чатов не несут состояния, их можно удалять
+            while len(self._chat_buckets) > SEND_CHAT_BUCKETS_LIMIT:
+                oldest_chat_id, oldest_bucket = next(iter(self._chat_buckets.items()))
+                if not oldest_bucket.idle:
+                    break
+                del self._chat_buckets[oldest_chat_id]
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def put(self, chat_id: Union[int, None], method: str, **kwargs: Any) -> asyncio.Future:
+        """
+        Постановка запроса в очередь
+
+        Возвращает future с результатом запроса (None, если запрос не удалось выполнить).
+        Если очередь не запущена (например, вне приложения), запрос выполняется сразу,
+        но с соблюдением тех же ограничений. Запросы без чата (chat_id=None, например ответы на callback-запросы)
+        не ограничиваются и выполняются сразу, минуя очередь сообщений
+        """
+
+        request = OutgoingRequest(
+            chat_id=chat_id,
+            method=method,
+            kwargs=kwargs if chat_id is None else {'chat_id': chat_id, **kwargs},
+            future=asyncio.get_running_loop().create_future(),
+        )
+        if self.running and chat_id is not None:
+            self._unfinished += 1
+            self._drained.clear()
+            if chat_id in self._chats:
+                # Чат уже ожидает обработки, запрос будет отправлен после предыдущих
+                self._chats[chat_id].append(request)
+            else:
+                self._chats[chat_id] = deque((request,))
+                self._schedule(chat_id)
+        else:
+            task = asyncio.create_task(self._process(request))
+            self._direct_tasks.add(task)
+            task.add_done_callback(self._direct_tasks.discard)
+
+        return request.future
+
+    def _schedule(self, chat_id: int) -> None:
+        """
+        Передача чата обработчикам сразу или по таймеру, когда у чата появится токен на отправку
+        """
+
+        delay = self._get_chat_bucket(chat_id).delay()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    def _on_flood(self, chat_id: Union[int, None], retry_after: float) -> None:
+        """
+        Учёт ответа 429 и приостановка отправки во все чаты, если ограничение относится ко всему боту
+
+        Ответ на запрос без чата или ответы из SEND_FLOOD_CHATS разных чатов за SEND_FLOOD_WINDOW секунд
+        означают ограничение на весь бот: без общей паузы остальные чаты тоже получили бы 429
+        и израсходовали бы попытки повтора
+        """
+
+        now = time.monotonic()
+        self._flood_chats = {
+            flood_chat_id: at for flood_chat_id, at in self._flood_chats.items() if at > now - SEND_FLOOD_WINDOW
+        }
+        self._flood_chats[chat_id] = now
+        if chat_id is None or len(self._flood_chats) >= SEND_FLOOD_CHATS:
+            self._global_bucket.pause(retry_after)
+            self.global_pauses += 1
+            logger.warning('Telegram flood limit for the bot, sending paused for %ss', retry_after)
+
+    def _finish(self) -> None:
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._drained.set()
+
+    def _resolve(self, request: OutgoingRequest, result: Any) -> None:
+        if not request.future.done():
+            request.future.set_result(result)
+
+    async def _process(self, request: OutgoingRequest) -> None:
+        """
+        Выполнение запроса вне очереди с ожиданием токена чата
+        """
+
+        if request.chat_id is not None:
+            await self._get_chat_bucket(request.chat_id).acquire()
+        if await self._send(request):
+            # Корзина чата приостановлена на retry_after, повторный запрос дождётся её токена
+            await self._process(request)
+
+    async def _send(self, request: OutgoingRequest) -> bool:
+        """
+        Отправка запроса (токен чата уже получен)
+
+        Возвращает True, если Telegram попросил повторить запрос позже (корзина чата приостановлена на retry_after)
+        """
+
+        from app.bot import bot
+
+        if request.chat_id is not None:
+            await self._global_bucket.acquire()
+
+        started = time.perf_counter()
+        try:
+            result = await getattr(bot, request.method)(**request.kwargs)
+        except ApiTelegramException as e:
+            telegram_request_errors.labels(request.method, str(e.error_code)).inc()
+            if e.error_code == 429:
+                retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                self._on_flood(request.chat_id, retry_after)
+                if request.chat_id is not None and request.attempts < self.max_retries:
+                    self._get_chat_bucket(request.chat_id).pause(retry_after)
+                    request.attempts += 1
+                    self.retried += 1
+                    return True
+            logger.warning('Telegram rejected %s to chat %s: %s', request.method, request.chat_id, e)
+            self.failed += 1
+            self._resolve(request, None)
+        except (ApiException, RequestTimeout) as e:
+            telegram_request_errors.labels(request.method, 'network').inc()
+            logger.warning('Failed to send %s to chat %s: %s', request.method, request.chat_id, e)
+            self.failed += 1
+            self._resolve(request, None)
+        # Неожиданная ошибка не должна останавливать обработчик очереди и оставлять future без результата
+        except Exception:  # noqa: PIE786
+            telegram_request_errors.labels(request.method, 'unexpected').inc()
+            logger.exception('Unexpected error sending %s to chat %s', request.method, request.chat_id)
+            self.failed += 1
+            self._resolve(request, None)
+        else:
+            telegram_request_duration.labels(request.method).observe(time.perf_counter() - started)
+            latency = time.perf_counter() - request.enqueued
+            self.sent += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self._resolve(request, result)
+        return False
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            requests = self._chats[chat_id]
+            # Токен мог забрать запрос, выполненный вне очереди: чат возвращается в работу по таймеру
+            if not self._get_chat_bucket(chat_id).try_acquire():
+                self._schedule(chat_id)
+                continue
+
+            request = requests.popleft()
+            try:
+                retry = await self._send(request)
+            except BaseException:
+                self._resolve(request, None)
+                self._finish()
+                raise
+            if retry:
+                requests.appendleft(request)
+            else:
+                self._finish()
+
+            if requests:
+                self._schedule(chat_id)
+            else:
+                del self._chats[chat_id]
+
+    async def start(self) -> None:
+        """
+        Запуск обработчиков очереди
+        """
+
+        if not self.running:
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = SEND_STOP_TIMEOUT) -> None:
+        """
+        Остановка обработчиков очереди после отправки накопившихся запросов (не дольше timeout секунд)
+        """
+
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Send queue stopped with %s undelivered requests', self.queue_depth)
+
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def stats(self) -> dict:
+        """
+        Показатели работы очереди: глубина, количество отправленных запросов и задержка отправки (в секундах)
+        """
+
+        return {
+            'queue_depth': self.queue_depth,
+            'chats': len(self._chats),
+            'workers': len(self._worker_tasks),
+            'chat_buckets': len(self._chat_buckets),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'global_pauses': self.global_pauses,
+            'latency_avg': self.latency_total / self.sent if self.sent else 0.0,
+            'latency_max': self.latency_max,
+        }
+
+
+send_queue = SendQueue()
+
+
+def send_message(chat_id: int, text: str, **kwargs: Any) -> asyncio.Future:
+    """
+    Отправка сообщения пользователю через общую очередь
+
+    Результат можно не ожидать, если подтверждение доставки не требуется
+    """
+
+    return send_queue.put(chat_id, 'send_message', text=text, **kwargs)
+
+
+def answer_callback(callback_query_id: str, text: Union[str, None] = None, **kwargs: Any) -> asyncio.Future:
+    """
+    Ответ на нажатие inline-кнопки (сразу, без ограничений очереди сообщений)
+
+    Пока ответ не получен, клиент Telegram показывает индикатор загрузки на кнопке
+    """
+
+    return send_queue.put(None, 'answer_callback_query', callback_query_id=callback_query_id, text=text, **kwargs)
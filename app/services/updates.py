@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.metrics import update_duration
+from app.database import async_session
+from app.services.authentication import authenticate
+from app.settings import (
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_STOP_TIMEOUT,
+    WEBHOOK_THROUGHPUT_WINDOW,
+    WEBHOOK_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def process_update(session: AsyncSession, data: dict) -> None:
+    """
+    Обработка обновления от Telegram
+
+    Обработчик выбирается по таблицам маршрутизатора бота, пользователь и сессия передаются ему аргументами
+    """
+
+    from app.bot import router
+
+    started = time.perf_counter()
+    try:
+        user = await authenticate(session=session, data=data)
+        if user is not None:
+            await router.dispatch(data, user=user, session=session)
+    finally:
+        update_duration.labels(get_update_type(data)).observe(time.perf_counter() - started)
+
+
+def get_update_type(data: dict) -> str:
+    """
+    Тип обновления (message, callback_query и т.д.)
+    """
+
+    return next((key for key in data if key != 'update_id'), 'unknown')
+
+
+def get_partition_key(data: dict) -> int:
+    """
+    Ключ распределения обновления по обработчикам: обновления одного пользователя
+    всегда попадают к одному обработчику и обрабатываются по порядку
+    """
+
+    if (msg_data := data.get('message')) or (msg_data := data.get('callback_query')):
+        if user_id := msg_data.get('from', {}).get('id'):
+            return user_id
+    return data['update_id']
+
+
+@dataclass
+class QueuedUpdate:
+    """
+    Обновление от Telegram, ожидающее обработки
+    """
+
+    data: dict
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+class UpdateWorkerPool:
+    """
+    Пул фоновых обработчиков обновлений от Telegram
+
+    Каждый обработчик читает свою ограниченную очередь, обновление попадает в очередь
+    по идентификатору пользователя, поэтому обновления одного чата не обгоняют друг друга
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        # Количество обработанных обновлений по секундам для расчёта пропускной способности
+        self._window: deque[list[int]] = deque()
+
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def put(self, data: dict) -> bool:
+        """
+        Постановка обновления в очередь
+
+        Возвращает False, если очередь соответствующего обработчика переполнена
+        """
+
+        queue = self._queues[get_partition_key(data) % self.workers]
+        try:
+            queue.put_nowait(QueuedUpdate(data=data))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.received += 1
+        return True
+
+    def _count_processed(self) -> None:
+        self.processed += 1
+        second = int(time.monotonic())
+        if self._window and self._window[-1][0] == second:
+            self._window[-1][1] += 1
+        else:
+            self._window.append([second, 1])
+        while self._window[0][0] <= second - WEBHOOK_THROUGHPUT_WINDOW:
+            self._window.popleft()
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            lag = time.perf_counter() - item.enqueued
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            try:
+                async with async_session() as session:
+                    await process_update(session=session, data=item.data)
+            # Любая ошибка обработки учитывается и не останавливает обработчик: иначе его очередь заполнится
+            # и обновления всех пользователей этой очереди будут отклоняться
+            except Exception:  # noqa: PIE786
+                logger.exception('Failed to process update %s', item.data.get('update_id'))
+                self.failed += 1
+            else:
+                self._count_processed()
+            finally:
+                queue.task_done()
+
+    async def start(self) -> None:
+        """
+        Запуск обработчиков
+        """
+
+        if not self.running:
+            maxsize = max(1, self.queue_size // self.workers)
+            self._queues = [asyncio.Queue(maxsize=maxsize) for _ in range(self.workers)]
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def join(self) -> None:
+        """
+        Ожидание завершения обработки всех поставленных в очередь обновлений (включая обрабатываемые сейчас)
+        """
+
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def stop(self, timeout: float = WEBHOOK_STOP_TIMEOUT) -> None:
+        """
+        Остановка обработчиков после обработки накопившихся обновлений (не дольше timeout секунд)
+        """
+
+        try:
+            await asyncio.wait_for(self.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Update workers stopped with %s unprocessed updates', self.queue_depth)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> dict:
+        """
+        Показатели работы пула: глубина очереди, пропускная способность (обновлений в секунду
+        за последние WEBHOOK_THROUGHPUT_WINDOW секунд) и задержка начала обработки (в секундах)
+        """
+
+        started = self.processed + self.failed
+        return {
+            'queue_depth': self.queue_depth,
+            'workers': len(self._tasks),
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'throughput': sum(count for _, count in self._window) / WEBHOOK_THROUGHPUT_WINDOW,
+            'lag_avg': self.lag_total / started if started else 0.0,
+            'lag_max': self.lag_max,
+        }
+
+
+update_pool = UpdateWorkerPool()
@@ -1,9 +1,81 @@
+from dataclasses import dataclass
 from typing import Union
 
-from sqlalchemy import select
+from sqlalchemy import column, exists, select, table, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import User
+from app.core.cache import TTLCache
+from app.core.utils import is_valid_zone, sql_localize
+from app.models import Habit, User
+from app.settings import (
+    TIMEZONE_CACHE_TTL,
+    TOKEN_VERSION_CACHE_TTL,
+    TZ,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+)
+
+# Часовые пояса, известные серверу PostgreSQL (его база часовых поясов может отличаться от pytz)
+pg_timezone_names = table('pg_timezone_names', column('name'))
+
+
+@dataclass(frozen=True)
+class UserIdentity:
+    """
+    Снимок идентификационных данных пользователя, не привязанный к сессии базы данных
+
+    Используется только для чтения, изменения выполняются через модель User. Пароль и токены не кэшируются:
+    они меняются при входе в webapp в любом процессе приложения и читаются из базы данных
+    """
+
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    token_version: int
+
+    name = property(User.name.fget)
+
+    @classmethod
+    def from_user(cls, user: User) -> 'UserIdentity':
+        return cls(
+            id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            token_version=user.token_version,
+        )
+
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# Номера поколений токенов пользователей для проверки access-токенов без загрузки пользователя
+token_versions = TTLCache(maxsize=USER_CACHE_SIZE, ttl=TOKEN_VERSION_CACHE_TTL)
+# Часовые пояса пользователей хранятся отдельно от данных пользователей с коротким временем жизни,
+# так как по ним вычисляется текущая дата целей
+user_timezones = TTLCache(maxsize=USER_CACHE_SIZE, ttl=TIMEZONE_CACHE_TTL)
+
+
+def cache_user(user: User) -> UserIdentity:
+    """
+    Сохранение актуальных данных пользователя в кэше (после их изменения)
+    """
+
+    identity = UserIdentity.from_user(user)
+    user_cache.set(user.id, identity)
+    token_versions.set(user.id, user.token_version)
+    user_timezones.set(user.id, user.timezone)
+
+    return identity
+
+
+def invalidate_user(user_id: int) -> None:
+    """
+    Удаление пользователя из кэша
+    """
+
+    user_cache.pop(user_id)
+    token_versions.pop(user_id)
+    user_timezones.pop(user_id)
 
 
 async def get_user(session: AsyncSession, user_id: Union[int, str]) -> Union[User, None]:
@@ -15,11 +87,95 @@ async def get_user(session: AsyncSession, user_id: Union[int, str]) -> Union[Use
     return res.unique().scalar_one_or_none()
 
 
-async def get_or_create_user(session: AsyncSession, user_id: int, user_data: dict) -> User:
+async def get_user_identity(session: AsyncSession, user_id: int) -> Union[UserIdentity, None]:
+    """
+    Получение данных пользователя для чтения с использованием кэша
+    """
+
+    if identity := user_cache.get(user_id):
+        return identity
+
+    if user := await get_user(session=session, user_id=user_id):
+        return cache_user(user)
+
+
+async def get_user_timezone(session: AsyncSession, user_id: int) -> str:
+    """
+    Часовой пояс пользователя с использованием кэша (TZ, если пользователь не найден)
+    """
+
+    if timezone := user_timezones.get(user_id):
+        return timezone
+
+    res = await session.execute(select(User.timezone).where(User.id == user_id))
+    if (timezone := res.scalar_one_or_none()) is None:
+        return TZ
+    user_timezones.set(user_id, timezone)
+
+    return timezone
+
+
+async def is_known_zone(session: AsyncSession, timezone: str) -> bool:
+    """
+    Проверка, что часовой пояс известен и pytz, и серверу PostgreSQL
+
+    Местная дата пользователя вычисляется и в приложении, и в запросах (подведение итогов дня, сверка
+    напоминаний), поэтому неизвестный серверу часовой пояс остановил бы подведение итогов для всех пользователей
+    """
+
+    if not is_valid_zone(timezone):
+        return False
+
+    res = await session.execute(select(exists().where(pg_timezone_names.c.name == timezone)))
+    return res.scalar_one()
+
+
+async def set_user_timezone(session: AsyncSession, user: User, timezone: str) -> Union[UserIdentity, None]:
+    """
+    Изменение часового пояса пользователя (None, если часовой пояс неизвестен)
+
+    Местные дата и время напоминаний целей сохраняются, моменты напоминаний в UTC пересчитываются тем же запросом
+    """
+
+    if not await is_known_zone(session=session, timezone=timezone):
+        return None
+
+    user.timezone = timezone
+    stmt = (
+        update(Habit)
+        .where(Habit.user_id == user.id, Habit.alert_date.is_not(None))
+        .values(alert_at=sql_localize(timezone, Habit.alert_date, Habit.alert_time))
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+    return cache_user(user)
+
+
+async def get_token_version(session: AsyncSession, user_id: int) -> Union[int, None]:
+    """
+    Получение номера поколения токенов пользователя с использованием кэша
+    """
+
+    if (token_version := token_versions.get(user_id)) is not None:
+        return token_version
+
+    res = await session.execute(select(User.token_version).where(User.id == user_id))
+    if (token_version := res.scalar_one_or_none()) is not None:
+        token_versions.set(user_id, token_version)
+
+    return token_version
+
+
+async def get_or_create_user(session: AsyncSession, user_id: int, user_data: dict) -> UserIdentity:
     """
     Получение или создание нового пользователя по его идентификатору (Telegram ID)
     """
 
+    if identity := user_cache.get(user_id):
+        return identity
+
     user = await get_user(session=session, user_id=user_id)
     if not user:
         user = User(
@@ -30,8 +186,10 @@ async def get_or_create_user(session: AsyncSession, user_id: int, user_data: dic
             last_name=user_data.get('last_name', ''),
             access_token='',
             refresh_token='',
+            token_version=0,
+            timezone=TZ,
         )
         session.add(user)
         await session.commit()
 
-    return user
+    return cache_user(user)
@@ -16,20 +16,118 @@ REFRESH_TOKEN_NAME = 'refresh-token'
 ACCESS_TOKEN_LIFETIME = 1  # hours
 EXPIRE_ACCESS_TOKEN = timedelta(hours=ACCESS_TOKEN_LIFETIME)
 EXPIRE_REFRESH_TOKEN = timedelta(hours=ACCESS_TOKEN_LIFETIME * 72)
+# Токен доступа к /metrics (заголовок Authorization: Bearer <токен>), без него метрики не отдаются
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Хэширование паролей (вне цикла событий)
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'process')  # process | thread
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+# Не более стольких вычислений хэшей одновременно, остальные ожидают очереди
+PASSWORD_HASH_MAX_IN_FLIGHT = int(os.getenv('PASSWORD_HASH_MAX_IN_FLIGHT', 4))
+# Количество раундов pbkdf2 для новых хэшей (0 - значение passlib по умолчанию)
+PASSWORD_HASH_ROUNDS = int(os.getenv('PASSWORD_HASH_ROUNDS', 0))
+
+# Кэш данных пользователей (в памяти процесса)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))  # seconds
+# Отозванный в другом процессе приложения access-токен принимается не дольше этого времени
+TOKEN_VERSION_CACHE_TTL = int(os.getenv('TOKEN_VERSION_CACHE_TTL', 30))  # seconds
+# Часовой пояс, изменённый в другом процессе приложения, применяется не позднее этого времени
+TIMEZONE_CACHE_TTL = int(os.getenv('TIMEZONE_CACHE_TTL', 30))  # seconds
+
+# Кэш целей пользователей на сегодня для /mark (в памяти процесса, сбрасывается при изменении целей в этом процессе)
+AGENDA_CACHE_SIZE = int(os.getenv('AGENDA_CACHE_SIZE', 10000))
+AGENDA_CACHE_TTL = int(os.getenv('AGENDA_CACHE_TTL', 60))  # seconds
+
+# Количество выполненных целей на одной странице архива (бот и webapp)
+HABITS_PAGE_SIZE = int(os.getenv('HABITS_PAGE_SIZE', 10))
+
+# Выгрузка и загрузка целей
+HABITS_EXPORT_CHUNK_SIZE = 500  # строк за одно чтение из курсора
+HABITS_IMPORT_CHUNK_SIZE = 1000  # строк в одном запросе на добавление
+HABITS_IMPORT_MAX_ROWS = int(os.getenv('HABITS_IMPORT_MAX_ROWS', 10000))
+HABITS_IMPORT_MAX_ERRORS = 100  # в ответе перечисляются только первые ошибки
+
+# Кэш отрисованных страниц webapp со списками целей (в памяти процесса)
+HABITS_PAGE_CACHE_SIZE = int(os.getenv('HABITS_PAGE_CACHE_SIZE', 1000))
+HABITS_PAGE_CACHE_TTL = int(os.getenv('HABITS_PAGE_CACHE_TTL', 3600))  # seconds
+# Каталог кэша скомпилированных шаблонов Jinja (по умолчанию - во временном каталоге)
+JINJA_BYTECODE_CACHE_DIR = os.getenv('JINJA_BYTECODE_CACHE_DIR')
 
 # Дата время
 DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Часовой пояс приложения и часовой пояс новых пользователей по умолчанию
 TZ = 'Europe/Moscow'
 
 # База данных
-DATABASE_DETAILS = 'admin:admin@postgresql_container:5432'
+DATABASE_DETAILS = os.getenv('DATABASE_DETAILS', 'admin:admin@postgresql_container:5432')
 DATABASE_URL_ASYNC = 'postgresql+asyncpg://' + DATABASE_DETAILS
 DATABASE_URL_SYNC = 'postgresql+psycopg2://' + DATABASE_DETAILS
+# Пул соединений одного процесса приложения: не более DB_POOL_SIZE + DB_MAX_OVERFLOW соединений
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # seconds
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # seconds
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Кэш подготовленных запросов asyncpg на соединение (0 - отключён, нужно для pgbouncer в режиме transaction)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+
+# Выбор ведущего процесса: задачи планировщика выполняет только процесс, захвативший advisory-блокировку
+LEADER_LOCK_KEY = int(os.getenv('LEADER_LOCK_KEY', 7_340_301))
+LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', 10))  # seconds
+# Имя процесса в health-проверке и в pg_stat_activity (по умолчанию - имя хоста и идентификатор процесса)
+INSTANCE_NAME = os.getenv('INSTANCE_NAME', '')
 
 # Apscheduler
+# Планировщик хранит только периодические задачи, которые добавляются при каждом запуске,
+# поэтому используется хранилище задач в памяти
 APSCHEDULER_CONFIG = {
-    'apscheduler.jobstores.default': {'type': 'sqlalchemy', 'url': DATABASE_URL_SYNC},
     'apscheduler.timezone': TZ,
-    'apscheduler.jobstore_retry_interval': 1,
     'apscheduler.misfire_grace_time': 1,
 }
+
+# Напоминания
+ALERT_BATCH_SIZE = int(os.getenv('ALERT_BATCH_SIZE', 100))
+ALERT_BATCH_INTERVAL = float(os.getenv('ALERT_BATCH_INTERVAL', 1))  # seconds
+# Напоминания одному пользователю на одну минуту объединяются в сообщения не более чем по столько целей
+# (у сообщения Telegram ограничены длина текста и количество кнопок)
+ALERT_DIGEST_SIZE = 20
+ALERT_TITLE_LENGTH = 100  # символов названия цели в тексте объединённого напоминания
+# Напоминания, пропущенные не более чем на это время (например, при перезапуске), отправляются с опозданием
+ALERT_CATCH_UP = timedelta(minutes=60)
+
+# Обработка webhook-ов
+# true - обновление ставится в очередь и ответ Telegram отправляется сразу, обработка идёт в фоне
+WEBHOOK_ASYNC_PROCESSING = os.getenv('WEBHOOK_ASYNC_PROCESSING', 'false').lower() == 'true'
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_THROUGHPUT_WINDOW = 60  # seconds
+WEBHOOK_STOP_TIMEOUT = 10  # seconds
+# Отсев повторно доставленных обновлений:
+# memory - по окну последних update_id в памяти процесса
+# postgres - дополнительно по таблице processed_update, общей для всех процессов приложения
+WEBHOOK_DEDUP_BACKEND = os.getenv('WEBHOOK_DEDUP_BACKEND', 'memory')
+WEBHOOK_DEDUP_WINDOW = 10000
+WEBHOOK_DEDUP_TTL = timedelta(days=1)
+
+# Очередь исходящих сообщений Telegram
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', 4))
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))  # сообщений в секунду на бота
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))  # сообщений в секунду в один чат
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', 3))
+SEND_CHAT_BUCKETS_LIMIT = 10000
+SEND_MAX_RETRIES = 3
+# Ответы 429 из стольких разных чатов за SEND_FLOOD_WINDOW секунд считаются ограничением на весь бот
+# и приостанавливают отправку во все чаты на retry_after
+SEND_FLOOD_CHATS = int(os.getenv('SEND_FLOOD_CHATS', 2))
+SEND_FLOOD_WINDOW = float(os.getenv('SEND_FLOOD_WINDOW', 1))  # seconds
+SEND_STOP_TIMEOUT = 10  # seconds
+
+# Подведение итогов дня
+ROLLOVER_NOTIFY_CONCURRENCY = int(os.getenv('ROLLOVER_NOTIFY_CONCURRENCY', 20))
+# Цели сбрасываются частями по диапазонам идентификаторов пользователей, каждая часть - в своей транзакции
+ROLLOVER_SHARD_SIZE = int(os.getenv('ROLLOVER_SHARD_SIZE', 1000))  # пользователей в части
+ROLLOVER_CONCURRENCY = int(os.getenv('ROLLOVER_CONCURRENCY', 4))  # частей одновременно (не больше пула соединений)
+# Уведомления о сбросе, не отправленные из-за перезапуска, досылаются не позже этого времени
+ROLLOVER_RESUME_WINDOW = timedelta(hours=6)
+ROLLOVER_CHECKPOINT_TTL = timedelta(days=7)
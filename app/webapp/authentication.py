@@ -3,16 +3,21 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import Response
 
-from app.bot import bot
 from app.core.dependencies import get_session
 from app.core.templates import templates
 from app.schemas import LoginForm, RegistrationForm
-from app.services import get_active_habits, get_markup, get_user, set_user_password
+from app.services import (
+    get_active_habits,
+    get_markup,
+    get_user,
+    set_user_password,
+)
 from app.services.authentication import (
     authorize,
     check_password,
     generate_user_tokens,
 )
+from app.services.sender import send_message
 from app.settings import (
     ACCESS_TOKEN_LIFETIME,
     ACCESS_TOKEN_NAME,
@@ -40,7 +45,7 @@ async def set_new_tokens(request: Request, idx: int = Path(...), session: AsyncS
             key=ACCESS_TOKEN_NAME, value=user.access_token, httponly=True, max_age=3600 * ACCESS_TOKEN_LIFETIME
         )
 
-        await bot.send_message(
+        send_message(
             user.id,
             text='❕ Новый вход в меню постановки целей.',
             disable_notification=False,
@@ -89,7 +94,7 @@ async def register(
         key=ACCESS_TOKEN_NAME, value=user.access_token, httponly=True, max_age=3600 * ACCESS_TOKEN_LIFETIME
     )
 
-    await bot.send_message(
+    send_message(
         user.id,
         text='❕ Новый вход в меню постановки целей.',
         disable_notification=False,
@@ -128,7 +133,7 @@ async def login(
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
     form_data = form.model_dump()
-    if check_password(user=user, password=form_data['password']):
+    if await check_password(user=user, password=form_data['password']):
         await generate_user_tokens(session=session, user=user)
 
         habits = await get_active_habits(session=session, user_id=idx)
@@ -139,7 +144,7 @@ async def login(
             key=ACCESS_TOKEN_NAME, value=user.access_token, httponly=True, max_age=3600 * ACCESS_TOKEN_LIFETIME
         )
 
-        await bot.send_message(
+        send_message(
             user.id,
             text='❕ Новый вход в меню постановки целей.',
             disable_notification=False,
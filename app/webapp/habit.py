@@ -1,29 +1,88 @@
-from fastapi import APIRouter, Depends, Path, Request
+import csv
+import io
+import json
+from dataclasses import asdict
+from typing import Any, AsyncIterator, Iterator, TextIO, Union
+
+from fastapi import APIRouter, Depends, File, Path, Query, Request, UploadFile
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
-from starlette.responses import Response
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 
+from app.core.cache import TTLCache
 from app.core.dependencies import get_session
-from app.core.templates import templates
-from app.schemas import HabitForm
+from app.core.templates import templates, templates_version
+from app.schemas import HabitForm, HabitImportRow
 from app.services import (
     create_habit,
     delete_habit,
     get_active_habits,
     get_completed_habits,
     get_habit,
+    get_habits_version,
     update_habit,
 )
-from app.services.authentication import (
-    authorize,
+from app.services.authentication import authorize_access
+from app.services.checkin import get_habit_stats
+from app.services.habit import (
+    HABIT_EXPORT_FIELDS,
+    HabitsPage,
+    ImportReport,
+    format_habit_key,
+    import_habits,
+    parse_habit_key,
+    stream_habits,
+    validate_import_rows,
 )
 from app.settings import (
     ACCESS_TOKEN_NAME,
+    HABITS_PAGE_CACHE_SIZE,
+    HABITS_PAGE_CACHE_TTL,
     HOST,
 )
 
 router = APIRouter(prefix='/webapp/{idx}', tags=['habit'])
 
+# Отрисованные страницы со списками целей по ключу (пользователь, страница, версия списка целей)
+habits_pages = TTLCache(maxsize=HABITS_PAGE_CACHE_SIZE, ttl=HABITS_PAGE_CACHE_TTL)
+
+
+def get_next_page_url(user_id: int, page: HabitsPage) -> Union[str, None]:
+    if page.has_next:
+        return f'{HOST}/webapp/{user_id}/completed/rows?after={format_habit_key(page.last_key)}'
+
+
+async def get_habits_page(
+    request: Request, session: AsyncSession, user_id: int, completed: bool = False, conditional: bool = True
+) -> Response:
+    """
+    Страница со списком активных или выполненных целей
+
+    Пока цели пользователя не менялись, страница не запрашивается из базы данных и не отрисовывается заново,
+    а браузер с актуальной копией страницы (If-None-Match) получает ответ 304
+    """
+
+    habits_version = await get_habits_version(session=session, user_id=user_id)
+    etag = f'W/"{templates_version}-{user_id}-{int(completed)}-{habits_version}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if conditional and etag in (tag.strip() for tag in request.headers.get('if-none-match', '').split(',')):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = (user_id, completed, habits_version)
+    if (content := habits_pages.get(key)) is None:
+        context = {'request': request, 'host': HOST, 'user_id': user_id, 'completed': completed}
+        if completed:
+            # Выполненные цели выводятся постранично, следующие страницы подгружаются по кнопке
+            page = await get_completed_habits(session=session, user_id=user_id)
+            context.update(habits=page.habits, next_url=get_next_page_url(user_id=user_id, page=page))
+        else:
+            context.update(habits=await get_active_habits(session=session, user_id=user_id))
+        content = templates.get_template('main.html').render(context)
+        habits_pages.set(key, content)
+
+    return HTMLResponse(content=content, headers=headers)
+
 
 @router.get('/home')
 async def get_homepage(request: Request, idx: int = Path(...), session: AsyncSession = Depends(get_session)):
@@ -31,13 +90,10 @@ async def get_homepage(request: Request, idx: int = Path(...), session: AsyncSes
     Главная страница со списком активных целей
     """
 
-    user = await authorize(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME))
-    if not user:
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
-    habits = await get_active_habits(session=session, user_id=idx)
-
-    return templates.TemplateResponse('main.html', {'request': request, 'host': HOST, 'user_id': idx, 'habits': habits})
+    return await get_habits_page(request=request, session=session, user_id=idx)
 
 
 @router.get('/completed')
@@ -46,14 +102,38 @@ async def get_completed(request: Request, idx: int = Path(...), session: AsyncSe
     Страница со списком выполненных целей
     """
 
-    user = await authorize(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME))
-    if not user:
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    return await get_habits_page(request=request, session=session, user_id=idx, completed=True)
+
+
+@router.get('/completed/rows')
+async def get_completed_rows(
+    request: Request, idx: int = Path(...), after: str = Query(...), session: AsyncSession = Depends(get_session)
+):
+    """
+    Следующая страница списка выполненных целей (строки таблицы)
+
+    Адрес следующей за ней страницы передаётся в заголовке X-Next-Page
+    """
+
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        after_key = parse_habit_key(after)
+    except ValueError:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
 
-    habits = await get_completed_habits(session=session, user_id=idx)
+    page = await get_completed_habits(session=session, user_id=idx, after=after_key)
+    headers = {}
+    if next_url := get_next_page_url(user_id=idx, page=page):
+        headers['X-Next-Page'] = next_url
 
     return templates.TemplateResponse(
-        'main.html', {'request': request, 'host': HOST, 'user_id': idx, 'habits': habits, 'completed': True}
+        'habit_rows.html',
+        {'request': request, 'host': HOST, 'user_id': idx, 'habits': page.habits, 'completed': True},
+        headers=headers,
     )
 
 
@@ -63,8 +143,7 @@ async def get_habit_create_form(request: Request, idx: int = Path(...), session:
     Получение формы добавления новой цели
     """
 
-    user = await authorize(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME))
-    if not user:
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
     return templates.TemplateResponse('habit_form.html', {'request': request, 'host': HOST, 'user_id': idx})
@@ -81,16 +160,13 @@ async def create(
     Обработка формы добавления новой цели
     """
 
-    user = await authorize(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME))
-    if not user:
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
     form_data = form.model_dump()
     await create_habit(session=session, user_id=idx, habit_data=form_data)
 
-    habits = await get_active_habits(session=session, user_id=idx)
-
-    return templates.TemplateResponse('main.html', {'request': request, 'host': HOST, 'user_id': idx, 'habits': habits})
+    return await get_habits_page(request=request, session=session, user_id=idx, conditional=False)
 
 
 @router.get('/habit/{habit_id}')
@@ -101,15 +177,15 @@ async def get_habit_update_form(
     Получение формы обновления цели
     """
 
-    user = await authorize(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME))
-    if not user:
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
     habit = await get_habit(session=session, user_id=idx, habit_id=habit_id)
     if not habit:
         return Response(status_code=status.HTTP_404_NOT_FOUND)
+    stats = await get_habit_stats(session=session, habit_id=habit_id)
 
     return templates.TemplateResponse(
-        'habit_form.html', {'request': request, 'host': HOST, 'user_id': idx, 'habit': habit}
+        'habit_form.html', {'request': request, 'host': HOST, 'user_id': idx, 'habit': habit, 'stats': stats}
     )
 
 
@@ -125,8 +201,7 @@ async def update(
     Обработка формы обновления цели
     """
 
-    user = await authorize(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME))
-    if not user:
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
     habit = await get_habit(session=session, user_id=idx, habit_id=habit_id, active=True)
     if not habit:
@@ -151,8 +226,7 @@ async def delete(
     Удаление цели
     """
 
-    user = await authorize(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME))
-    if not user:
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
     habit = await get_habit(session=session, user_id=idx, habit_id=habit_id)
     if not habit:
@@ -161,3 +235,101 @@ async def delete(
     await delete_habit(session=session, habit=habit)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def export_csv(user_id: int) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HABIT_EXPORT_FIELDS)
+    async for rows in stream_habits(user_id=user_id):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def export_json_lines(user_id: int) -> AsyncIterator[str]:
+    async for rows in stream_habits(user_id=user_id):
+        yield ''.join(json.dumps(row._asdict(), default=str, ensure_ascii=False) + '\n' for row in rows)
+
+
+def read_csv(file: TextIO) -> Iterator[dict]:
+    for row in csv.DictReader(file):
+        # Пустые ячейки считаются незаполненными полями, лишние ячейки без заголовка отбрасываются
+        yield {key: value for key, value in row.items() if key and value != ''}
+
+
+def read_json_lines(file: TextIO) -> Iterator[Any]:
+    for line in file:
+        if line := line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Строка будет отклонена при проверке
+                yield line
+
+
+def parse_import_file(file: UploadFile) -> tuple[list[HabitImportRow], ImportReport]:
+    """
+    Чтение и проверка строк загружаемого файла (выполняется в пуле потоков, чтобы не блокировать цикл событий)
+
+    Обёртка для чтения текста отсоединяется от файла, чтобы закрыть его мог только сам UploadFile
+    """
+
+    text_file = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+    try:
+        if file.content_type == 'text/csv' or (file.filename or '').endswith('.csv'):
+            return validate_import_rows(read_csv(text_file))
+        return validate_import_rows(read_json_lines(text_file))
+    finally:
+        text_file.detach()
+
+
+@router.get('/habits/export')
+async def export(
+    request: Request,
+    idx: int = Path(...),
+    export_format: str = Query('csv', alias='format', pattern='^(csv|json)$'),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Выгрузка всех целей пользователя в формате CSV или JSON Lines (format=json)
+    """
+
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    if export_format == 'csv':
+        content, media_type, filename = export_csv(user_id=idx), 'text/csv', 'habits.csv'
+    else:
+        content, media_type, filename = export_json_lines(user_id=idx), 'application/x-ndjson', 'habits.jsonl'
+
+    return StreamingResponse(
+        content, media_type=media_type, headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@router.post('/habits/import')
+async def import_(
+    request: Request,
+    file: UploadFile = File(...),
+    idx: int = Path(...),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Загрузка целей из файла CSV или JSON Lines (формат выгрузки)
+
+    Корректные строки добавляются, в ответе перечисляются номера и причины отклонения остальных
+    """
+
+    if not await authorize_access(session=session, user_id=idx, token=request.cookies.get(ACCESS_TOKEN_NAME)):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    try:
+        habits, report = await run_in_threadpool(parse_import_file, file)
+    except (csv.Error, UnicodeDecodeError):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    report = await import_habits(session=session, user_id=idx, habits=habits, report=report)
+
+    return JSONResponse(content=asdict(report))
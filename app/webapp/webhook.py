@@ -1,30 +1,45 @@
 from fastapi import APIRouter, Depends, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from telebot import types
+from starlette import status
+from starlette.responses import Response
 
-from app.bot import bot
 from app.core.dependencies import get_session
-from app.services import authenticate
+from app.core.metrics import webhook_updates
+from app.services import forget_update, process_update, register_update, update_pool
+from app.settings import WEBHOOK_ASYNC_PROCESSING
 
 router = APIRouter(prefix='/webhook', tags=['webhook'])
 
 
 @router.post('')
-async def webhook(request: Request, session: AsyncSession = Depends(get_session)) -> None:
+async def webhook(request: Request, session: AsyncSession = Depends(get_session)) -> Response:
     """
     Endpoint для webhook-ов от Telegram client
     """
 
     data = await request.json()
-    user = await authenticate(session=session, data=data)
+    if not isinstance(data, dict) or not isinstance(data.get('update_id'), int):
+        webhook_updates.labels('invalid').inc()
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    # Повторная доставка уже полученного обновления. Если обновление не удастся поставить в очередь
+    # или обработать, регистрация отменяется, чтобы его повторная доставка не была отброшена
+    if not await register_update(session=session, update_id=data['update_id']):
+        webhook_updates.labels('duplicate').inc()
+        return Response(status_code=status.HTTP_200_OK)
 
-    extra_data = {'user': user, 'session': session}
-    # Обработка обычных сообщений
-    if message := data.get('message'):
-        message['extra_data'] = extra_data
-    # Обработка обычных событий вызванных callback-кнопками
-    elif callback_query := data.get('callback_query'):
-        callback_query['extra_data'] = extra_data
-    update = types.Update.de_json(data)
+    if WEBHOOK_ASYNC_PROCESSING:
+        # Telegram получает ответ сразу, обновление обрабатывается в фоне
+        if not update_pool.put(data):
+            webhook_updates.labels('rejected').inc()
+            await forget_update(update_id=data['update_id'])
+            return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        webhook_updates.labels('queued').inc()
+    else:
+        try:
+            await process_update(session=session, data=data)
+        except BaseException:
+            await forget_update(update_id=data['update_id'])
+            raise
+        webhook_updates.labels('processed').inc()
 
-    await bot.process_new_updates([update])
+    return Response(status_code=status.HTTP_200_OK)
@@ -0,0 +1,191 @@
+"""
+Замер планов выполнения запросов сервисного слоя к таблице habit
+
+Скрипт заполняет базу данных тестовыми пользователями и целями, после чего для каждого запроса
+сервисного слоя выполняет EXPLAIN (ANALYZE) дважды: без индексов из миграции 26d22d32a1b9
+(индексы удаляются внутри транзакции, которая затем откатывается) и с ними.
+
+Запуск на отдельной базе данных с применёнными миграциями:
+    DATABASE_DETAILS=admin:admin@localhost:5432 python -m benchmarks.query_plans --seed --output plans.json
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from app.core.utils import aware_now
+from app.services.daily_results import build_reset_stmt
+from app.services.habit import (
+    build_mark_stmt,
+    select_active_habits,
+    select_agenda,
+    select_completed_habits,
+    select_habit,
+)
+from app.services.notification import build_claim_stmt
+from app.settings import DATABASE_URL_ASYNC, TZ
+
+INDEXES = [
+    'ix_habit_user_id_alert_date',
+    'ix_habit_user_id_active',
+    'ix_habit_user_id_completed_date_id',
+    'ix_habit_alert_at',
+]
+
+SEED_USERS_SQL = '''
+INSERT INTO "user" (id, username, password, first_name, last_name, access_token, refresh_token)
+SELECT id, 'user' || id, '', '', '', '', ''
+FROM generate_series(1, CAST(:users AS integer)) AS id
+ON CONFLICT (id) DO NOTHING
+'''
+
+# Около трети целей выполнены, остальные распределены по датам напоминаний вокруг текущего дня
+SEED_HABITS_SQL = '''
+INSERT INTO habit (user_id, title, description, target, process, alert_time, alert_date, completed_date)
+SELECT
+    1 + n % CAST(:users AS integer),
+    'habit ' || n,
+    '',
+    21,
+    n % 21,
+    make_time((n % 24)::int, (n % 60)::int, 0),
+    CASE WHEN n % 3 = 0 THEN NULL ELSE CAST(:today AS date) + (n % 3 - 1) END,
+    CASE WHEN n % 3 = 0 THEN CAST(:today AS date) - n % 365 END
+FROM generate_series(1, CAST(:habits AS integer)) AS n
+'''
+
+
+def compile_query(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def get_queries(user_id: int, habit_id: int, first_user_id: int, last_user_id: int) -> dict:
+    """
+    Запросы, построенные теми же функциями, что и в сервисном слое (app/services/habit.py, notification.py,
+    daily_results.py), поэтому замер всегда соответствует текущим запросам
+    """
+
+    now = aware_now()
+
+    return {
+        'get_habit': select_habit(user_id=user_id, habit_id=habit_id),
+        'get_active_habits': select_active_habits(user_id=user_id),
+        'get_completed_habits': select_completed_habits(user_id=user_id),
+        'get_actual_habits': select_agenda(user_id=user_id, day=now.date()),
+        'mark_habit': build_mark_stmt(habit_id=habit_id, user_id=user_id, tz=TZ, day=now.date()),
+        'dispatch_alerts': build_claim_stmt(now=now),
+        'summarize_daily_results': build_reset_stmt(
+            first_user_id=first_user_id, last_user_id=last_user_id, checkpoint_id=0
+        ),
+    }
+
+
+async def explain(conn: AsyncConnection, query: str, repeat: int) -> dict:
+    """
+    Медиана времени планирования и выполнения запроса, а также план последнего выполнения
+    """
+
+    planning, execution, plan = [], [], None
+    for _ in range(repeat):
+        # Изменяющие запросы (подведение итогов) выполняются и откатываются вместе с транзакцией
+        async with conn.begin_nested() as savepoint:
+            res = await conn.execute(text(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}'))
+            result = res.scalar_one()[0]
+            await savepoint.rollback()
+        planning.append(result['Planning Time'])
+        execution.append(result['Execution Time'])
+        plan = result['Plan']
+
+    return {
+        'planning_ms': statistics.median(planning),
+        'execution_ms': statistics.median(execution),
+        'node': plan['Node Type'],
+        'index': plan.get('Index Name'),
+        'plan': plan,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    engine = create_async_engine(DATABASE_URL_ASYNC)
+
+    if args.seed:
+        async with engine.begin() as conn:
+            await conn.execute(text(SEED_USERS_SQL), {'users': args.users})
+            await conn.execute(
+                text(SEED_HABITS_SQL), {'users': args.users, 'habits': args.habits, 'today': aware_now().date()}
+            )
+            await conn.execute(
+                text('UPDATE habit SET alert_at = timezone(:tz, alert_date + alert_time) WHERE alert_date IS NOT NULL'),
+                {'tz': TZ},
+            )
+            await conn.execute(text('ANALYZE habit'))
+
+    async with engine.connect() as conn:
+        habits_count = (await conn.execute(text('SELECT count(*) FROM habit'))).scalar_one()
+        user_id, habit_id = (
+            await conn.execute(
+                text('SELECT user_id, max(id) FROM habit GROUP BY user_id ORDER BY count(*) DESC LIMIT 1')
+            )
+        ).one()
+        first_user_id, last_user_id = (await conn.execute(text('SELECT min(id), max(id) FROM "user"'))).one()
+
+        stmts = get_queries(user_id=user_id, habit_id=habit_id, first_user_id=first_user_id, last_user_id=last_user_id)
+        queries = {name: compile_query(stmt) for name, stmt in stmts.items()}
+        results = {name: {} for name in queries}
+
+        async with conn.begin() as transaction:
+            for name, query in queries.items():
+                results[name]['with_indexes'] = await explain(conn=conn, query=query, repeat=args.repeat)
+
+            for index in INDEXES:
+                await conn.execute(text(f'DROP INDEX IF EXISTS {index}'))
+            for name, query in queries.items():
+                results[name]['without_indexes'] = await explain(conn=conn, query=query, repeat=args.repeat)
+
+            # Индексы возвращаются на место вместе с откатом транзакции
+            await transaction.rollback()
+
+    await engine.dispose()
+
+    return {
+        'benchmark': 'query_plans',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'habits': habits_count,
+        'user_id': user_id,
+        'repeat': args.repeat,
+        'queries': queries,
+        'results': results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', action='store_true', help='заполнить базу данных тестовыми данными')
+    parser.add_argument('--users', type=int, default=20000, help='количество пользователей для заполнения')
+    parser.add_argument('--habits', type=int, default=200000, help='количество целей для заполнения')
+    parser.add_argument('--repeat', type=int, default=5, help='количество замеров каждого запроса')
+    parser.add_argument('--output', help='файл для сохранения результатов в формате JSON')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    for name, result in report['results'].items():
+        before, after = result['without_indexes'], result['with_indexes']
+        print(
+            f'{name:<25} {before["node"]:<18} {before["execution_ms"]:>10.3f} ms  ->  '
+            f'{after["node"]:<18} {after["execution_ms"]:>10.3f} ms  {after["index"] or ""}'
+        )
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Микро-замер стоимости выбора обработчика для одного обновления
+
+Сравниваются два пути с одинаковым набором обработчиков-заглушек (без базы данных и Telegram Bot API):
+- telebot: добавление extra_data в обновление, types.Update.de_json и AsyncTeleBot.process_new_updates
+  (последовательная проверка фильтров всех зарегистрированных обработчиков);
+- router: app.core.router.UpdateRouter.dispatch (выбор обработчика по имени команды или префиксу callback-данных).
+
+Для каждого типа обновления (/start, /mark, /timezone с аргументом, нажатия habit#N и archive#..., обычный текст
+без обработчика) выводится среднее время в микросекундах и ускорение. Результат можно сохранить в JSON.
+
+Пример:
+    python -m benchmarks.router_dispatch --iterations 20000 --output router.json
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import time
+
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+
+from app.core.router import UpdateRouter
+
+COMMANDS = ('start', 'webapp', 'timezone', 'archive', 'mark')
+CALLBACK_PREFIXES = ('archive', 'habit')
+
+USER = {'id': 1, 'is_bot': False, 'first_name': 'user1', 'username': 'user1'}
+CHAT = {'id': 1, 'type': 'private'}
+
+
+def build_message_update(text: str) -> dict:
+    return {
+        'update_id': 1,
+        'message': {'message_id': 1, 'date': 0, 'chat': CHAT, 'from': USER, 'text': text},
+    }
+
+
+def build_callback_update(data: str) -> dict:
+    keyboard = [[{'text': f'Цель {i}', 'callback_data': f'habit#{i}'}] for i in range(1, 11)]
+    return {
+        'update_id': 1,
+        'callback_query': {
+            'id': '1',
+            'chat_instance': '1',
+            'from': USER,
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': 0,
+                'chat': CHAT,
+                'from': USER,
+                'text': 'Чтобы отметить выполнение, просто нажмите соответствующую кнопку',
+                'reply_markup': {'inline_keyboard': keyboard},
+            },
+        },
+    }
+
+
+SAMPLES = {
+    'start': build_message_update('/start'),
+    'mark': build_message_update('/mark'),
+    'timezone': build_message_update('/timezone Europe/Berlin'),
+    'habit': build_callback_update('habit#5'),
+    'archive': build_callback_update('archive#next#11#2024-01-01.15'),
+    'text': build_message_update('Привет'),
+}
+
+
+async def noop(*args, **kwargs) -> None:
+    pass
+
+
+def build_telebot() -> AsyncTeleBot:
+    """
+    Бот с обработчиками-заглушками, зарегистрированными так же, как раньше в app.bot
+    """
+
+    bot = AsyncTeleBot('1:benchmark')
+    for command in COMMANDS:
+        bot.message_handler(commands=[command])(noop)
+    for prefix in CALLBACK_PREFIXES:
+        bot.callback_query_handler(func=lambda callback, prefix=prefix: callback.data.startswith(f'{prefix}#'))(noop)
+    return bot
+
+
+def build_router() -> UpdateRouter:
+    router = UpdateRouter()
+    router.command(*COMMANDS)(noop)
+    for prefix in CALLBACK_PREFIXES:
+        router.callback(prefix)(noop)
+    return router
+
+
+async def dispatch_telebot(bot: AsyncTeleBot, data: dict) -> None:
+    extra_data = {'user': None, 'session': None}
+    if message := data.get('message'):
+        message['extra_data'] = extra_data
+    elif callback_query := data.get('callback_query'):
+        callback_query['extra_data'] = extra_data
+    await bot.process_new_updates([types.Update.de_json(data)])
+
+
+async def measure(dispatch, data: dict, iterations: int) -> float:
+    """
+    Среднее время обработки обновления в микросекундах
+
+    Каждая обработка получает свою копию обновления (как после разбора тела запроса webhook),
+    копии готовятся заранее и в замер не входят
+    """
+
+    samples = [copy.deepcopy(data) for _ in range(iterations)]
+    started = time.perf_counter()
+    for sample in samples:
+        await dispatch(sample)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def run(args: argparse.Namespace) -> dict:
+    bot, router = build_telebot(), build_router()
+
+    async def telebot_path(data: dict) -> None:
+        await dispatch_telebot(bot, data)
+
+    async def router_path(data: dict) -> None:
+        await router.dispatch(data, user=None, session=None)
+
+    results = {}
+    for name, data in SAMPLES.items():
+        # Прогрев, чтобы не учитывать первоначальные затраты
+        await measure(telebot_path, data, iterations=100)
+        await measure(router_path, data, iterations=100)
+
+        telebot_us = await measure(telebot_path, data, iterations=args.iterations)
+        router_us = await measure(router_path, data, iterations=args.iterations)
+        results[name] = {
+            'telebot_us': round(telebot_us, 3),
+            'router_us': round(router_us, 3),
+            'speedup': round(telebot_us / router_us, 1) if router_us else None,
+        }
+
+    return {'params': vars(args), 'results': results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10000, help='количество обновлений каждого типа')
+    parser.add_argument('--output', help='файл для сохранения результатов в формате JSON')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f'{"update":<10} {"telebot, us":>12} {"router, us":>12} {"speedup":>8}')
+    for name, result in report['results'].items():
+        print(f'{name:<10} {result["telebot_us"]:>12.2f} {result["router_us"]:>12.2f} {result["speedup"]:>7}x')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+"""
+Сквозной замер пропускной способности webhook
+
+Скрипт поднимает в одном процессе:
+- поддельный Telegram Bot API (записывает вызовы sendMessage, setWebhook и др.);
+- приложение app.main:app на uvicorn, подключённое к локальному PostgreSQL (DATABASE_DETAILS).
+Затем заполняет базу данных пользователями и целями и отправляет на /webhook набор обновлений
+(/start, /mark, /archive и нажатия кнопок habit#N) с заданной степенью параллелизма.
+
+Результат (задержки p50/p95/p99, обновлений в секунду, SQL-запросов на обновление) сохраняется в JSON,
+который можно сравнить с результатом предыдущего запуска (--compare) для поиска регрессий.
+
+Пример:
+    DATABASE_DETAILS=admin:admin@localhost:5432 python -m benchmarks.webhook_throughput \\
+        --create-schema --updates 5000 --concurrency 50 --output webhook.json --compare webhook_prev.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from aiohttp import ClientSession, web
+
+BOT_TOKEN = '123456:benchmark'
+
+# Доля каждого типа обновлений в наборе
+DEFAULT_MIX = {'start': 0.05, 'mark': 0.4, 'archive': 0.15, 'callback': 0.4}
+
+# Метрики, рост (или падение) которых считается регрессией, и допустимое отклонение
+REGRESSION_CHECKS = {
+    'updates_per_second': -0.1,
+    'latency_ms.p95': 0.1,
+    'sql_statements_per_update': 0.0,
+}
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotApi:
+    """
+    Поддельный Telegram Bot API, отвечающий успехом на любой вызов
+    """
+
+    def __init__(self) -> None:
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+
+        result = True
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            data = await request.post()
+            self._message_id += 1
+            result = {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+                'text': data.get('text', ''),
+            }
+
+        return web.json_response({'ok': True, 'result': result})
+
+    async def start(self, port: int) -> web.AppRunner:
+        application = web.Application()
+        application.router.add_route('*', '/bot{token}/{method}', self.handle)
+        runner = web.AppRunner(application, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        return runner
+
+
+def build_message_update(update_id: int, user_id: int, command: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'},
+            'text': f'/{command}',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command) + 1}],
+        },
+    }
+
+
+def build_callback_update(update_id: int, user_id: int, habit_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'},
+            'data': f'habit#{habit_id}',
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'Чтобы отметить выполнение, просто нажмите соответствующую кнопку',
+            },
+        },
+    }
+
+
+def build_updates(count: int, mix: dict, habits: list[tuple[int, int]], seed: int) -> list[tuple[str, dict]]:
+    """
+    Набор обновлений заданного состава для пользователей и целей из базы данных
+    """
+
+    rnd = random.Random(seed)
+    kinds = rnd.choices(list(mix), weights=list(mix.values()), k=count)
+    updates = []
+    for update_id, kind in enumerate(kinds, start=1):
+        habit_id, user_id = rnd.choice(habits)
+        if kind == 'callback':
+            updates.append((kind, build_callback_update(update_id=update_id, user_id=user_id, habit_id=habit_id)))
+        else:
+            updates.append((kind, build_message_update(update_id=update_id, user_id=user_id, command=kind)))
+    return updates
+
+
+def percentiles(values: list[float]) -> dict:
+    if len(values) < 2:
+        values = values * 2 or [0.0, 0.0]
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'p50': cuts[49],
+        'p95': cuts[94],
+        'p99': cuts[98],
+        'max': max(values),
+        'mean': statistics.fmean(values),
+    }
+
+
+async def seed_database(users: int, habits_per_user: int, create_schema: bool) -> list[tuple[int, int]]:
+    """
+    Заполнение базы данных пользователями и целями
+
+    Цели пользователей замера пересоздаются при каждом запуске, поэтому набор данных не растёт от запуска
+    к запуску и результаты можно сравнивать. Моменты напоминаний заполняются так же, как при создании цели:
+    в часовом поясе пользователя, а напоминания, время которых уже прошло, считаются отправленными
+    """
+
+    from sqlalchemy import text
+
+    from app.database import Base, engine
+
+    async with engine.begin() as conn:
+        if create_schema:
+            await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            text(
+                'INSERT INTO "user" (id, username, password, first_name, last_name, access_token, refresh_token) '
+                "SELECT id, 'user' || id, '', 'user' || id, '', '', '' "
+                'FROM generate_series(1, CAST(:users AS integer)) AS id ON CONFLICT (id) DO NOTHING'
+            ),
+            {'users': users},
+        )
+        await conn.execute(text('DELETE FROM habit WHERE user_id <= :users'), {'users': users})
+        await conn.execute(
+            text(
+                'INSERT INTO habit '
+                '(user_id, title, description, target, process, alert_time, alert_date, alert_at, alerted_date) '
+                "SELECT u.id, 'habit ' || h, '', 21, 0, a.alert_time, a.today, a.alert_at, "
+                'CASE WHEN a.alert_at <= now() THEN a.today END '
+                'FROM "user" AS u CROSS JOIN generate_series(1, CAST(:habits AS integer)) AS h, '
+                'LATERAL (SELECT make_time(h % 24, 0, 0) AS alert_time, '
+                'CAST(timezone(u.timezone, now()) AS date) AS today) AS l, '
+                'LATERAL (SELECT l.alert_time, l.today, timezone(u.timezone, l.today + l.alert_time) AS alert_at) AS a '
+                'WHERE u.id <= :users'
+            ),
+            {'users': users, 'habits': habits_per_user},
+        )
+        res = await conn.execute(
+            text('SELECT id, user_id FROM habit WHERE user_id <= :users AND completed_date IS NULL'),
+            {'users': users},
+        )
+        return [tuple(row) for row in res.all()]
+
+
+async def replay(url: str, updates: list[tuple[str, dict]], concurrency: int) -> tuple[dict, int, float]:
+    """
+    Отправка обновлений на webhook не более чем concurrency запросами одновременно
+    """
+
+    latencies = defaultdict(list)
+    errors = 0
+    queue = asyncio.Queue()
+    for item in updates:
+        queue.put_nowait(item)
+
+    async def worker(session: ClientSession) -> None:
+        nonlocal errors
+        while not queue.empty():
+            kind, update = queue.get_nowait()
+            started = time.perf_counter()
+            async with session.post(url, json=update) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies[kind].append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run(args: argparse.Namespace) -> dict:
+    api_port, app_port = get_free_port(), get_free_port()
+
+    os.environ.setdefault('BOT_TOKEN', BOT_TOKEN)
+    os.environ.setdefault('SECRET_PYJWT_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('SECRET_PYJWT_REFRESH_KEY', 'benchmark')
+    os.environ['HOST'] = f'http://127.0.0.1:{app_port}'
+
+    import uvicorn
+    from sqlalchemy import event
+    from telebot import asyncio_helper
+
+    from app import settings
+    from app.database import engine
+
+    asyncio_helper.API_URL = f'http://127.0.0.1:{api_port}/bot{{0}}/{{1}}'
+
+    fake_api = FakeBotApi()
+    api_runner = await fake_api.start(port=api_port)
+
+    habits = await seed_database(
+        users=args.users, habits_per_user=args.habits_per_user, create_schema=args.create_schema
+    )
+    updates = build_updates(count=args.updates, mix=args.mix, habits=habits, seed=args.seed)
+
+    statements = 0
+
+    def count_statement(*_) -> None:
+        nonlocal statements
+        statements += 1
+
+    # Процесс не участвует в выборе ведущего: иначе во время замера выполнялись бы рассылка напоминаний
+    # и подведение итогов дня, и их запросы попадали бы в sql_statements_per_update
+    from app.services import leader
+
+    async def skip_leader_election(**_) -> None:
+        pass
+
+    leader.start = skip_leader_election
+
+    server = uvicorn.Server(uvicorn.Config('app.main:app', host='127.0.0.1', port=app_port, log_level='warning'))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', count_statement)
+    fake_api.calls.clear()
+
+    started = time.perf_counter()
+    latencies, errors, duration = await replay(
+        url=f'http://127.0.0.1:{app_port}/webhook', updates=updates, concurrency=args.concurrency
+    )
+    if settings.WEBHOOK_ASYNC_PROCESSING:
+        # В режиме быстрого ответа обработка завершается уже после ответа webhook,
+        # поэтому пропускная способность считается до завершения обработки всех обновлений
+        from app.services import update_pool
+
+        await update_pool.join()
+        duration = time.perf_counter() - started
+
+    event.remove(engine.sync_engine, 'before_cursor_execute', count_statement)
+    telegram_calls = dict(fake_api.calls)
+
+    server.should_exit = True
+    await server_task
+    await api_runner.cleanup()
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+
+    return {
+        'benchmark': 'webhook_throughput',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'config': {
+            'updates': args.updates,
+            'concurrency': args.concurrency,
+            'users': args.users,
+            'habits_per_user': args.habits_per_user,
+            'mix': args.mix,
+            'seed': args.seed,
+            'webhook_async_processing': settings.WEBHOOK_ASYNC_PROCESSING,
+        },
+        'results': {
+            'duration': duration,
+            'errors': errors,
+            'updates_per_second': len(all_latencies) / duration,
+            'latency_ms': percentiles(all_latencies),
+            'latency_ms_by_type': {kind: percentiles(values) for kind, values in sorted(latencies.items())},
+            'sql_statements_per_update': statements / len(all_latencies),
+            'telegram_calls': telegram_calls,
+        },
+    }
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def get_metric(report: dict, path: str) -> float:
+    value = report['results']
+    for key in path.split('.'):
+        value = value[key]
+    return value
+
+
+def compare(report: dict, baseline: dict) -> list[str]:
+    """
+    Сравнение с результатом предыдущего запуска, возвращает список регрессий
+    """
+
+    regressions = []
+    for path, tolerance in REGRESSION_CHECKS.items():
+        current, previous = get_metric(report, path), get_metric(baseline, path)
+        change = (current - previous) / previous if previous else 0.0
+        print(f'{path:<30} {previous:>12.3f} -> {current:>12.3f} ({change:+.1%})')
+        if (tolerance < 0 and change < tolerance) or (tolerance >= 0 and change > tolerance):
+            regressions.append(path)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000, help='количество обновлений')
+    parser.add_argument('--concurrency', type=int, default=20, help='количество одновременных запросов')
+    parser.add_argument('--users', type=int, default=500, help='количество пользователей')
+    parser.add_argument('--habits-per-user', type=int, default=5, help='количество целей у пользователя')
+    parser.add_argument('--mix', type=json.loads, default=DEFAULT_MIX, help='состав обновлений в формате JSON')
+    parser.add_argument('--seed', type=int, default=1, help='начальное значение генератора случайных чисел')
+    parser.add_argument('--create-schema', action='store_true', help='создать таблицы без миграций (пустая база)')
+    parser.add_argument('--output', help='файл для сохранения результатов в формате JSON')
+    parser.add_argument('--compare', help='файл с результатами предыдущего запуска для сравнения')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    results = report['results']
+    print(
+        f'{args.updates} updates in {results["duration"]:.2f}s: {results["updates_per_second"]:.1f} upd/s, '
+        f'p50={results["latency_ms"]["p50"]:.1f}ms p95={results["latency_ms"]["p95"]:.1f}ms '
+        f'p99={results["latency_ms"]["p99"]:.1f}ms, {results["sql_statements_per_update"]:.2f} SQL/update, '
+        f'errors={results["errors"]}'
+    )
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report=report, baseline=json.load(file))
+        if regressions:
+            print('Regressions: ' + ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()